@@ -0,0 +1,95 @@
+"""Deterministic synthetic Persian corpora for the benchmarks.
+
+Pages are generated in the layouts of `Way2PayParser` and `MelliFaqParser`,
+the same seed and sizes always produce the same files.
+"""
+import os
+import random
+from typing import List, Text
+
+from shpachatbot.io import DEFAULT_ENCODING
+
+WORDS = (
+    "بانک پرداخت کارت حساب مشتری انتقال پول رمز سامانه خدمات تراکنش اینترنتی موبایل شعبه وام سود "
+    "سپرده قسط چک اعتبار ارز نرخ بورس سهام بیمه مالیات قرارداد درخواست پیگیری پشتیبانی تماس "
+    "می‌شود می‌کند کرده‌اند خواهد بود است هستند شد کردند دارد داشت گرفت داد رفت آمد گفت "
+    "کتاب‌ها مشتریان کارت‌ها حساب‌های تراکنش‌ها بانک‌ها خدمات شعبه‌ها درخواست‌ها "
+    "جدید مهم بزرگ سریع آسان امن رایگان ویژه ملی مرکزی دولتی خصوصی "
+    "در از به با برای که این آن را تا بر هم یا اما اگر چون پس نیز"
+).split()
+DIGITS = "۰۱۲۳۴۵۶۷۸۹"
+
+WAY2PAY_PAGE = """<!DOCTYPE html>
+<html lang="fa" dir="rtl"><head><meta charset="utf-8"><title>{title}</title></head>
+<body><header><nav>{menu}</nav></header>
+<article><div class="post-header-title"><span class="term-badge">{badge}</span></div>
+<h1 class="single-post-title">{title}</h1>
+<time class="post-published" datetime="{date}">{date}</time>
+<div class="single-post-content">{content}</div>
+<div class="post-tags">{tags}</div></article>
+<footer>{menu}</footer></body></html>
+"""
+
+MELLI_FAQ_PAGE = """<!DOCTYPE html>
+<html lang="fa" dir="rtl"><head><meta charset="utf-8"><title>{title}</title></head>
+<body><div class="accordion">{cards}</div></body></html>
+"""
+
+MELLI_FAQ_CARD = """<div class="card"><div class="card-header"><a href="#c{idx}">{question}</a></div>
+<div class="collapse" id="c{idx}"><div class="card-body">{answer}</div></div></div>
+"""
+
+
+def sentence(rng: random.Random, words: int) -> Text:
+    tokens = rng.choices(WORDS, k=words)
+    if rng.random() < 0.3:
+        tokens.insert(rng.randrange(len(tokens)), ''.join(rng.choices(DIGITS, k=4)))
+    return ' '.join(tokens) + rng.choice(('.', '.', '.', '؟', '!'))
+
+
+def paragraph(rng: random.Random, sentences: int, words: int) -> Text:
+    return ' '.join(sentence(rng, words) for _ in range(sentences))
+
+
+def way2pay_page(rng: random.Random, paragraphs: int = 5, sentences: int = 4, words: int = 12) -> Text:
+    content = ''.join(f"<p>{paragraph(rng, sentences, words)}</p>" for _ in range(paragraphs))
+    return WAY2PAY_PAGE.format(
+        title=sentence(rng, 6),
+        menu=' '.join(f'<a href="/c/{i}">{w}</a>' for i, w in enumerate(rng.sample(WORDS, 8))),
+        badge=rng.choice(WORDS),
+        date=f"2020-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        content=content,
+        tags=''.join(f'<a href="/tag/{w}">{w}</a>' for w in rng.sample(WORDS, 3)),
+    )
+
+
+def melli_faq_page(rng: random.Random, questions: int = 10, sentences: int = 2, words: int = 12) -> Text:
+    cards = ''.join(MELLI_FAQ_CARD.format(idx=idx, question=sentence(rng, 8)[:-1] + '؟',
+                                          answer=paragraph(rng, sentences, words))
+                    for idx in range(questions))
+    return MELLI_FAQ_PAGE.format(title=sentence(rng, 4), cards=cards)
+
+
+def texts(count: int, sentences: int = 4, words: int = 12, seed: int = 0) -> List[Text]:
+    """Plain Persian texts, e.g. for the messages of the component benchmarks."""
+
+    rng = random.Random(seed)
+    return [paragraph(rng, sentences, words) for _ in range(count)]
+
+
+def write_corpus(path: Text, layout: Text = "way2pay", pages: int = 100, seed: int = 0, **sizes: int) -> List[Text]:
+    """Write `pages` html files of a layout into `path`.
+
+    Returns:
+        The paths of the written files.
+    """
+    generate = {"way2pay": way2pay_page, "melli_faq": melli_faq_page}[layout]
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    paths = []
+    for idx in range(pages):
+        file_path = os.path.join(path, f"{layout}-{idx:06d}.html")
+        with open(file_path, 'w', encoding=DEFAULT_ENCODING) as f:
+            f.write(generate(rng, **sizes))
+        paths.append(file_path)
+    return paths
@@ -0,0 +1,323 @@
+"""Benchmarks of the hot paths of the preprocessing pipeline.
+
+Run all benchmarks and store the results as a baseline:
+
+    python -m benchmarks.run --output baseline.json
+
+Run them again later and compare against the baseline, the command fails
+when a benchmark became slower than the tolerance allows:
+
+    python -m benchmarks.run --compare baseline.json --tolerance 0.2
+
+`--only` selects benchmarks by name prefix, e.g. `--only tokenizer parse`.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+from benchmarks import corpus
+from shpachatbot import __version__
+from shpachatbot.io import json_to_string, read_json_file, write_text_file
+from shpachatbot.nlu.models import Message
+
+# modules which must not be loaded by importing the pipeline, see `bench_import`
+HEAVY_MODULES = ("hazm", "nltk", "elasticsearch", "ruamel", "bs4", "lxml", "numpy", "scipy", "tqdm", "aiohttp")
+
+
+class Benchmark:
+    """A timed function, `prepare` creates its untimed input before every repetition."""
+
+    def __init__(
+            self,
+            name: Text,
+            run: Callable[[Any], Any],
+            items: int,
+            unit: Text = "messages",
+            prepare: Optional[Callable[[], Any]] = None,
+            repeat: Optional[int] = None,
+            extra: Optional[Dict[Text, Any]] = None,
+    ) -> None:
+        self.name = name
+        self.run = run
+        self.items = items
+        self.unit = unit
+        self.prepare = prepare
+        self.repeat = repeat
+        self.extra = extra if extra is not None else {}
+
+    def measure(self, repeat: int) -> Dict[Text, Any]:
+        timings = []
+        for _ in range(self.repeat or repeat):
+            data = self.prepare() if self.prepare else None
+            start = time.perf_counter()
+            self.run(data)
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        return {
+            **self.extra,
+            "seconds": seconds,
+            "median": statistics.median(timings),
+            "repeat": len(timings),
+            "items": self.items,
+            "unit": self.unit,
+            "items_per_second": self.items / seconds if seconds else None,
+        }
+
+
+def _messages(texts: List[Text]) -> List[Message]:
+    return [Message(text) for text in texts]
+
+
+def parser_benchmarks(args: argparse.Namespace, tmp_path: Text) -> List[Benchmark]:
+    from shpachatbot.nlu.html_utils.parser import MelliFaqParser, Way2PayParser
+
+    benchmarks = []
+    for layout, parser_cls in (("way2pay", Way2PayParser), ("melli_faq", MelliFaqParser)):
+        paths = corpus.write_corpus(os.path.join(tmp_path, layout), layout, args.pages, args.seed)
+
+        def run(_, paths=paths, parser_cls=parser_cls):
+            for path in paths:
+                parser_cls(path).parse_to_messages()
+
+        benchmarks.append(Benchmark(f"parse.{layout}", run, len(paths), unit="pages"))
+    return benchmarks
+
+
+def component_benchmarks(args: argparse.Namespace, tmp_path: Text) -> List[Benchmark]:
+    from shpachatbot.nlu.tokenizers.hazm import HazmNormalizer, HazmTokenizer
+    from shpachatbot.nlu.train.ngrams import Ngrams
+
+    texts = corpus.texts(args.messages, seed=args.seed)
+    benchmarks = []
+
+    normalizer = HazmNormalizer()
+    benchmarks.append(Benchmark("normalizer", normalizer.process_batch, len(texts),
+                                prepare=lambda: _messages(texts)))
+    normalized = _messages(texts)
+    normalizer.process_batch(normalized)
+    normalized_texts = [m.text for m in normalized]
+
+    variants = {
+        "plain": {"stemmer": False, "lemmatizer": False},
+        "stemmer": {"stemmer": True, "lemmatizer": False},
+        "lemmatizer": {"stemmer": False, "lemmatizer": True},
+        "stemmer_lemmatizer": {"stemmer": True, "lemmatizer": True},
+    }
+    pos_model = HazmTokenizer.defaults["pos_model"]
+    if os.path.exists(pos_model):
+        variants["pos"] = {"stemmer": True, "lemmatizer": True, "pos": True}
+    else:
+        print(f"Skipping 'tokenizer.pos', the tagger model '{pos_model}' does not exist.", file=sys.stderr)
+    for variant, config in variants.items():
+        if not _selected(f"tokenizer.{variant}", args.only):
+            continue
+        tokenizer = HazmTokenizer(dict(config))
+        benchmarks.append(Benchmark(f"tokenizer.{variant}", tokenizer.process_batch, len(texts),
+                                    prepare=lambda: _messages(normalized_texts)))
+
+    if not (_selected("ngrams", args.only) or _selected("serialize", args.only)):
+        return benchmarks
+    tokenized = _messages(normalized_texts)
+    HazmTokenizer().process_batch(tokenized)
+    ngrams = Ngrams()
+    benchmarks.append(Benchmark("ngrams", lambda _: ngrams.process_batch(tokenized), len(tokenized)))
+    benchmarks.append(Benchmark("serialize.message_json", lambda _: [m.json for m in tokenized], len(tokenized)))
+
+    from shpachatbot.nlu.serialization import (UnknownJsonBackendException, dumps_message, get_json_backend,
+                                               iter_messages, write_messages)
+
+    for backend_name in ("json", "orjson"):
+        try:
+            backend = get_json_backend(backend_name)
+        except UnknownJsonBackendException:
+            continue
+        benchmarks.append(Benchmark(f"serialize.dumps_message.{backend_name}",
+                                    lambda _, backend=backend: [dumps_message(m, backend) for m in tokenized],
+                                    len(tokenized)))
+    messages_path = os.path.join(tmp_path, "messages.jsonl")
+    write_messages(tokenized, messages_path)
+    benchmarks.append(Benchmark("serialize.load_messages",
+                                lambda _: [m.sentences for m in iter_messages(messages_path)], len(tokenized)))
+    return benchmarks
+
+
+def bench_import(args: argparse.Namespace, tmp_path: Text) -> List[Benchmark]:
+    """Time a fresh interpreter importing the pipeline and check which heavy modules it loads."""
+
+    code = (f"import sys; import shpachatbot.nlu.pipline; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    command = [sys.executable, "-c", code]
+    repository_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.run(command, check=True, capture_output=True, text=True, cwd=repository_path).stdout.strip()
+    return [Benchmark("import.pipeline",
+                      lambda _: subprocess.run(command, check=True, capture_output=True, cwd=repository_path),
+                      1, unit="imports", extra={"heavy_modules": [m for m in loaded.split(',') if m]})]
+
+
+def preprocessor_benchmarks(args: argparse.Namespace, tmp_path: Text) -> List[Benchmark]:
+    from shpachatbot.nlu.html_utils.parser import Way2PayParser
+    from shpachatbot.nlu.pipline import PreProcessor
+
+    input_path = os.path.join(tmp_path, "preprocess-input")
+    corpus.write_corpus(input_path, "way2pay", args.pages, args.seed)
+    benchmarks = []
+    for workers in args.workers:
+        def prepare(workers=workers):
+            out_path = tempfile.mkdtemp(prefix=f"out-{workers}-", dir=tmp_path)
+            return PreProcessor(input_path, out_path)
+
+        def run(preprocessor, workers=workers):
+            preprocessor.process(Way2PayParser, workers=workers, chunk_size=args.chunk_size)
+
+        # every run starts a new pool, the workers load the models again
+        benchmarks.append(Benchmark(f"preprocess.workers_{workers}", run, args.pages, unit="pages",
+                                    prepare=prepare, repeat=1))
+    return benchmarks
+
+
+def serve_benchmarks(args: argparse.Namespace, tmp_path: Text) -> List[Benchmark]:
+    """Send the messages as concurrent utterances to a `MicroBatcher`, without http."""
+
+    import asyncio
+
+    from shpachatbot.config import load
+    from shpachatbot.nlu.pipline import Pipeline
+    from shpachatbot.server import MicroBatcher
+
+    texts = corpus.texts(args.messages, sentences=1, seed=args.seed)
+    pipeline = Pipeline.create(load())
+    latency = {}
+
+    async def serve(batcher: MicroBatcher) -> None:
+        batcher.start()
+        try:
+            await asyncio.gather(*(batcher.process(text) for text in texts))
+        finally:
+            await batcher.stop()
+
+    def run(_):
+        # a new batcher per run, so no utterance is served from the cache of an earlier run
+        batcher = MicroBatcher(pipeline)
+        asyncio.run(serve(batcher))
+        stats = batcher.stats
+        latency.update(latency=stats["latency"], average_batch_size=stats["average_batch_size"])
+
+    # filled by every run, the results hold the latencies of the last run
+    return [Benchmark("serve.micro_batch", run, len(texts), unit="utterances", extra=latency)]
+
+
+# the name prefixes of the benchmarks of every group, groups without selected benchmarks are not set up
+BENCHMARK_GROUPS = [
+    (("import",), bench_import),
+    (("parse",), parser_benchmarks),
+    (("normalizer", "tokenizer", "ngrams", "serialize"), component_benchmarks),
+    (("serve",), serve_benchmarks),
+    (("preprocess",), preprocessor_benchmarks),
+]
+
+
+def _selected(name: Text, prefixes: Optional[List[Text]]) -> bool:
+    return not prefixes or any(name.startswith(p) for p in prefixes)
+
+
+def _group_selected(names: Tuple[Text, ...], prefixes: Optional[List[Text]]) -> bool:
+    return not prefixes or any(n.startswith(p) or p.startswith(n) for n in names for p in prefixes)
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[Text, Any]:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="shpa-bench-") as tmp_path:
+        for names, group in BENCHMARK_GROUPS:
+            if not _group_selected(names, args.only):
+                continue
+            for benchmark in group(args, tmp_path):
+                if not _selected(benchmark.name, args.only):
+                    continue
+                result = benchmark.measure(args.repeat)
+                results[benchmark.name] = result
+                print(f"{benchmark.name:<32} {result['seconds']:>10.4f}s "
+                      f"{result['items_per_second'] or 0:>12.1f} {result['unit']}/s", file=sys.stderr)
+
+    return {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pages": args.pages,
+            "messages": args.messages,
+            "seed": args.seed,
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(results: Dict[Text, Any], baseline: Dict[Text, Any], tolerance: float) -> List[Text]:
+    """Compare results with a baseline.
+
+    Returns:
+        The names of the benchmarks which regressed: they are slower than the
+        baseline by more than `tolerance`, or load heavy modules on import
+        which the baseline did not load.
+    """
+    regressions = []
+    print(f"{'benchmark':<32} {'baseline':>10} {'current':>10} {'ratio':>8}")
+    for name, result in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            print(f"{name:<32} {'-':>10} {result['seconds']:>10.4f} {'new':>8}")
+            continue
+        ratio = result["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+        new_modules = set(result.get("heavy_modules", [])) - set(base.get("heavy_modules", []))
+        regressed = ratio > 1 + tolerance or bool(new_modules)
+        if regressed:
+            regressions.append(name)
+        note = " REGRESSION" if regressed else ""
+        if new_modules:
+            note += f" (imports {', '.join(sorted(new_modules))})"
+        print(f"{name:<32} {base['seconds']:>10.4f} {result['seconds']:>10.4f} {ratio:>8.2f}{note}")
+    return regressions
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the shpachatbot preprocessing pipeline.")
+    parser.add_argument("--only", nargs="+", help="run only the benchmarks whose names start with these prefixes")
+    parser.add_argument("--pages", type=int, default=200, help="number of generated html pages")
+    parser.add_argument("--messages", type=int, default=500, help="number of messages of the component benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of every benchmark, the fastest counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="worker counts of the end-to-end preprocessing benchmark")
+    parser.add_argument("--chunk-size", type=int, default=32, help="files per task of the preprocessing benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpus")
+    parser.add_argument("--output", help="write the results as json to this file, e.g. to create a baseline")
+    parser.add_argument("--compare", help="compare the results with this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative slowdown before a benchmark counts as a regression")
+    return parser
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    args = create_argument_parser().parse_args(argv)
+    results = run_benchmarks(args)
+    if args.output:
+        write_text_file(json_to_string(results), args.output)
+    else:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.compare:
+        regressions = compare(results, read_json_file(args.compare), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,45 @@ import logging
 import os
 from typing import Any, Dict, List, Optional, Text, Union
 
-from shpachatbot.io import json_to_string
+from shpachatbot.constants import DEFAULT_CONFIG_PATH
+from shpachatbot.io import json_to_string, read_config_file
+from shpachatbot.utils import override_defaults
 
 logger = logging.getLogger(__name__)
 
 
+def load(
+        config: Optional[Union[Text, Dict]] = None, **kwargs: Any
+) -> "NLUModelConfig":
+    """Load an NLU model configuration.
+
+    Args:
+        config: path to a yaml configuration file or a configuration dictionary.
+            The default configuration is used if nothing is given.
+        kwargs: values which override the loaded configuration.
+
+    Returns:
+        The loaded configuration.
+    """
+    if isinstance(config, Dict):
+        return _load_from_dict(config, **kwargs)
+
+    file_config = {}
+    if config is None and os.path.isfile(DEFAULT_CONFIG_PATH):
+        config = DEFAULT_CONFIG_PATH
+
+    if config is not None:
+        file_config = read_config_file(config)
+
+    return _load_from_dict(file_config, **kwargs)
+
+
+def _load_from_dict(config: Dict, **kwargs: Any) -> "NLUModelConfig":
+    if kwargs:
+        config = override_defaults(config, kwargs)
+    return NLUModelConfig(config)
+
+
 class NLUModelConfig:
     """A class that stores NLU model configuration parameters."""
 
@@ -1,3 +1,7 @@
+import os
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config", "default_config.yml")
+
 TEXT = "text"
 
 
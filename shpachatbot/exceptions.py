@@ -38,3 +38,11 @@ class YamlSyntaxException(SHPAException):
             "YAML syntax of your file."
         )
         return exception_text
+
+
+class InvalidConfigException(ValueError, SHPAException):
+    """Raised if an invalid configuration is encountered."""
+
+
+class ComponentNotFoundException(ValueError, SHPAException):
+    """Raised if a component name in the pipeline is not registered."""
@@ -1,14 +1,15 @@
 import json
 import os
 from pathlib import Path
-from typing import Union, Text, Dict, Any, List
-
-from ruamel import yaml as yaml
-from elasticsearch import Elasticsearch
-from yaml import YAMLError
+from typing import Union, Text, Dict, Any, List, Iterable, Iterator, Optional, Tuple, TYPE_CHECKING
 
 from shpachatbot.exceptions import YamlSyntaxException
 
+# ruamel and elasticsearch are imported where they are used, importing them
+# slows down the start of every process which only needs the other helpers
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
 DEFAULT_ENCODING = "utf-8"
 YAML_VERSION = (1, 2)
 
@@ -20,9 +21,36 @@ def read_file(filename: Union[Text, Path], encoding: Text = DEFAULT_ENCODING) ->
         return f.read()
 
 
+def write_text_file(
+        content: Text,
+        file_path: Union[Text, Path],
+        encoding: Text = DEFAULT_ENCODING,
+        append: bool = False,
+) -> None:
+    """Writes text to a file.
+
+    Args:
+        content: The content to write.
+        file_path: The path to which the content should be written.
+        encoding: The encoding which should be used.
+        append: Whether to append to the file or to truncate the file.
+    """
+    mode = "a" if append else "w"
+    with open(file_path, mode, encoding=encoding) as file:
+        file.write(content)
+
+
+def read_json_file(filename: Union[Text, Path]) -> Any:
+    """Read json from a file."""
+
+    return json.loads(read_file(filename))
+
+
 def fix_yaml_loader() -> None:
     """Ensure that any string read by yaml is represented as unicode."""
 
+    from ruamel import yaml
+
     def construct_yaml_str(self, node):
         # Override the default string handling function
         # to always return unicode objects
@@ -46,6 +74,8 @@ def read_yaml(content: Text, reader_type: Union[Text, List[Text]] = "safe") -> A
     Raises:
         ruamel.yaml.parser.ParserError: If there was an error when parsing the YAML.
     """
+    from ruamel import yaml
+
     fix_yaml_loader()
 
     yaml_parser = yaml.YAML(typ=reader_type)
@@ -76,6 +106,8 @@ def read_yaml_file(filename: Union[Text, Path]) -> Union[List[Any], Dict[Text, A
     Returns:
         Parsed content of the file.
     """
+    from ruamel.yaml.error import YAMLError
+
     try:
         return read_yaml(read_file(filename, DEFAULT_ENCODING))
     except YAMLError as e:
@@ -120,12 +152,87 @@ def json_to_string(obj: Any, **kwargs: Any) -> Text:
     return json.dumps(obj, indent=indent, ensure_ascii=ensure_ascii, **kwargs)
 
 
+# clients are shared by all stores with the same connection settings,
+# so their connection pools are reused
+_elastic_clients: Dict[Text, "Elasticsearch"] = {}
+
+
+def get_elastic_client(hosts: Optional[Any] = None, **client_kwargs: Any) -> "Elasticsearch":
+    """Return a cached Elasticsearch client for the given connection settings."""
+
+    from elasticsearch import Elasticsearch
+
+    key = json.dumps([hosts, client_kwargs], sort_keys=True, default=str)
+    if key not in _elastic_clients:
+        _elastic_clients[key] = Elasticsearch(hosts, **client_kwargs)
+    return _elastic_clients[key]
+
+
 class ElasticStore:
-    def __init__(self, index="posts"):
+    def __init__(self, index="posts", hosts=None, client=None, **client_kwargs):
         self._index = index
-        self._es = Elasticsearch()
+        self._es = client if client is not None else get_elastic_client(hosts, **client_kwargs)
 
     def dump_json(self, doc):
         res = self._es.index(index=self._index, body=doc)
         # The result of the indexing operation, created or updated.
         return res['result']
+
+    def _bulk_actions(self, docs: Iterable[Any], id_field: Optional[Text]) -> Iterator[Dict[Text, Any]]:
+        for doc in docs:
+            # messages of the nlu pipeline are indexed with their serialized form
+            source = doc.dict if hasattr(doc, "dict") else doc
+            action = {"_index": self._index, "_source": source}
+            if id_field and source.get(id_field) is not None:
+                action["_id"] = source[id_field]
+            yield action
+
+    def bulk_index(
+            self,
+            docs: Iterable[Any],
+            id_field: Optional[Text] = "id",
+            chunk_size: int = 500,
+            max_chunk_bytes: int = 10 * 1024 * 1024,
+            thread_count: int = 1,
+            max_retries: int = 0,
+    ) -> Tuple[int, List[Dict[Text, Any]]]:
+        """Index a stream of documents or messages with the `_bulk` API.
+
+        Documents are consumed lazily and sent in requests of at most
+        `chunk_size` documents and `max_chunk_bytes` bytes. With a
+        `thread_count` above one the requests are sent in parallel.
+
+        Args:
+            docs: dictionaries or `Message` objects to index.
+            id_field: field which holds the document id, if any.
+            chunk_size: maximum number of documents per request.
+            max_chunk_bytes: maximum size of a request in bytes.
+            thread_count: number of threads sending requests.
+            max_retries: retries of documents rejected with status 429,
+                only used without parallel requests.
+
+        Returns:
+            The number of indexed documents and the errors of the failed ones.
+        """
+        from elasticsearch import helpers
+
+        actions = self._bulk_actions(docs, id_field)
+        if thread_count > 1:
+            results = helpers.parallel_bulk(self._es, actions,
+                                            thread_count=thread_count,
+                                            chunk_size=chunk_size,
+                                            max_chunk_bytes=max_chunk_bytes,
+                                            raise_on_error=False)
+        else:
+            results = helpers.streaming_bulk(self._es, actions,
+                                             chunk_size=chunk_size,
+                                             max_chunk_bytes=max_chunk_bytes,
+                                             max_retries=max_retries,
+                                             raise_on_error=False)
+        success, errors = 0, []
+        for ok, item in results:
+            if ok:
+                success += 1
+            else:
+                errors.append(item)
+        return success, errors
@@ -0,0 +1,106 @@
+import contextlib
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, Optional, Text, Union
+
+from shpachatbot.io import json_to_string, write_text_file
+
+STAGE_FIELDS = ("calls", "messages", "tokens", "wall_time", "cpu_time", "memory_delta")
+
+
+class Metrics:
+    """Collects the time spent in the stages of a pipeline run.
+
+    A stage is any named step, e.g. reading, parsing, a component or
+    writing. For every stage the number of calls, processed messages and
+    tokens, the wall and CPU time and, with `track_memory`, the change of the
+    memory allocated by Python are summed up. Metrics of several processes
+    are combined with `merge`.
+    """
+
+    def __init__(self, track_memory: bool = False) -> None:
+        self.track_memory = track_memory
+        self._stages: Dict[Text, Dict[Text, Union[int, float]]] = {}
+
+    def _stage(self, name: Text) -> Dict[Text, Union[int, float]]:
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = dict.fromkeys(STAGE_FIELDS, 0)
+        return stage
+
+    def add(self, name: Text, messages: int = 0, tokens: int = 0, wall_time: float = 0.0, cpu_time: float = 0.0,
+            memory_delta: int = 0, calls: int = 1) -> None:
+        stage = self._stage(name)
+        stage["calls"] += calls
+        stage["messages"] += messages
+        stage["tokens"] += tokens
+        stage["wall_time"] += wall_time
+        stage["cpu_time"] += cpu_time
+        stage["memory_delta"] += memory_delta
+
+    @contextlib.contextmanager
+    def measure(self, name: Text) -> Iterator[Dict[Text, int]]:
+        """Measure a block as one call of a stage.
+
+        The block can set the `messages` and `tokens` it processed on the
+        yielded dictionary.
+        """
+        counts = {"messages": 0, "tokens": 0}
+        track_memory = self.track_memory and tracemalloc.is_tracing()
+        memory = tracemalloc.get_traced_memory()[0] if track_memory else 0
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            self.add(name,
+                     messages=counts["messages"],
+                     tokens=counts["tokens"],
+                     wall_time=time.perf_counter() - wall,
+                     cpu_time=time.process_time() - cpu,
+                     memory_delta=tracemalloc.get_traced_memory()[0] - memory if track_memory else 0)
+
+    def merge(self, other: Union["Metrics", Dict[Text, Dict[Text, Any]]]) -> None:
+        """Add the stages of other metrics or of a `snapshot` of them."""
+
+        stages = other.snapshot() if isinstance(other, Metrics) else other
+        for name, values in stages.items():
+            self.add(name, **{field: values.get(field, 0) for field in STAGE_FIELDS})
+
+    def snapshot(self, reset: bool = False) -> Dict[Text, Dict[Text, Union[int, float]]]:
+        """The raw values of all stages, they can be sent to another process and merged there."""
+
+        stages = {name: dict(values) for name, values in self._stages.items()}
+        if reset:
+            self._stages = {}
+        return stages
+
+    @property
+    def stages(self) -> Dict[Text, Dict[Text, Any]]:
+        """All stages with their throughput in messages and tokens per second of wall time."""
+
+        stages = {}
+        for name, values in self._stages.items():
+            stage = dict(values)
+            wall_time = values["wall_time"]
+            stage["messages_per_second"] = values["messages"] / wall_time if wall_time else None
+            stage["tokens_per_second"] = values["tokens"] / wall_time if wall_time else None
+            if not self.track_memory:
+                del stage["memory_delta"]
+            stages[name] = stage
+        return stages
+
+    def report(self, path: Optional[Text] = None, **info: Any) -> Dict[Text, Any]:
+        """Create a report of all stages and write it as json to `path`.
+
+        Args:
+            path: the file to write the report to, if any.
+            info: additional values of the run, e.g. the number of workers.
+
+        Returns:
+            The report.
+        """
+        report = dict(info)
+        report["stages"] = self.stages
+        if path:
+            write_text_file(json_to_string(report), path)
+        return report
@@ -0,0 +1,223 @@
+import logging
+import os
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+from shpachatbot.constants import TEXT, TOKEN_ATTRIBUTE_LEMM
+from shpachatbot.io import json_to_string, read_json_file, write_text_file
+from shpachatbot.nlu.models import Message
+from shpachatbot.nlu.writers import iter_records
+
+logger = logging.getLogger(__name__)
+
+META_FILE_NAME = "meta.json"
+ARRAY_NAMES = ("term_offsets", "postings", "exception_positions", "exception_values", "weights", "document_lengths")
+# the low bits of every document gap are stored in the postings, larger gaps also have an exception
+GAP_BITS = 16
+GAP_MASK = (1 << GAP_BITS) - 1
+
+
+def encode_postings(documents: np.ndarray, term_offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compress posting lists of ascending document numbers.
+
+    Every posting list is stored as the gaps between its documents, the
+    first document as its gap to zero. The low 16 bits of each gap are kept
+    in a uint16 array, the few gaps which need more bits are exceptions:
+    their positions and high bits are kept in two extra arrays.
+
+    Returns:
+        The uint16 gaps, the positions of the exceptions and their high bits.
+    """
+    gaps = documents.astype(np.int64)
+    gaps[1:] -= documents[:-1]
+    starts = term_offsets[:-1][term_offsets[:-1] < term_offsets[1:]]
+    gaps[starts] = documents[starts]
+    exception_positions = np.flatnonzero(gaps >> GAP_BITS).astype(np.int64)
+    exception_values = (gaps[exception_positions] >> GAP_BITS).astype(np.int32)
+    return (gaps & GAP_MASK).astype(np.uint16), exception_positions, exception_values
+
+
+def message_terms(message: Message, attribute: Text = TOKEN_ATTRIBUTE_LEMM) -> List[Text]:
+    """The terms of a processed message, the token text where the attribute is missing."""
+
+    terms = []
+    for sentence in message.sentences:
+        values = sentence.token_attribute(attribute)
+        terms.extend(v if v is not None else t for v, t in zip(values, sentence.token_texts))
+    return terms
+
+
+def record_terms(record: Dict[Text, Any], attribute: Text = TOKEN_ATTRIBUTE_LEMM) -> List[Text]:
+    """The terms of a message record read from the shards of a pipeline."""
+
+    return [token.get(attribute, token[TEXT])
+            for sentence in record.get("sentences", []) for token in sentence["tokens"]]
+
+
+class BM25Index:
+    """An inverted index which ranks documents with Okapi BM25.
+
+    The posting lists are stored in compressed sparse row layout: the
+    postings of term `t` are `postings[term_offsets[t]:term_offsets[t + 1]]`
+    and hold the document numbers in ascending order, compressed by
+    `encode_postings` to about two bytes per posting. Next to each posting
+    its BM25 weight is precomputed as float32, so scoring a query is a sum of
+    array slices. An index saved with `save` is a directory of `.npy` files
+    which `load` maps into memory instead of reading them.
+    """
+
+    def __init__(
+            self,
+            terms: List[Text],
+            document_ids: List[Any],
+            term_offsets: np.ndarray,
+            postings: np.ndarray,
+            exception_positions: np.ndarray,
+            exception_values: np.ndarray,
+            weights: np.ndarray,
+            document_lengths: np.ndarray,
+            k1: float = 1.2,
+            b: float = 0.75,
+            attribute: Text = TOKEN_ATTRIBUTE_LEMM,
+    ) -> None:
+        self.terms = terms
+        self.document_ids = document_ids
+        self.term_offsets = term_offsets
+        self.postings = postings
+        self.exception_positions = exception_positions
+        self.exception_values = exception_values
+        self.weights = weights
+        self.document_lengths = document_lengths
+        self.k1 = k1
+        self.b = b
+        self.attribute = attribute
+        self._term_ids = {term: idx for idx, term in enumerate(terms)}
+
+    def __len__(self) -> int:
+        return len(self.document_ids)
+
+    @classmethod
+    def build(
+            cls,
+            documents: Iterable[Tuple[Any, Sequence[Text]]],
+            k1: float = 1.2,
+            b: float = 0.75,
+            attribute: Text = TOKEN_ATTRIBUTE_LEMM,
+    ) -> "BM25Index":
+        """Build an index from pairs of document id and document terms."""
+
+        term_ids = {}
+        document_ids = []
+        lengths = array('i')
+        posting_terms, posting_documents, posting_tfs = array('i'), array('i'), array('i')
+        for document_id, terms in documents:
+            document = len(document_ids)
+            document_ids.append(document_id)
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                term_id = term_ids.setdefault(term, len(term_ids))
+                posting_terms.append(term_id)
+                posting_documents.append(document)
+                posting_tfs.append(tf)
+
+        posting_terms = np.frombuffer(posting_terms, dtype=np.int32)
+        # a stable sort keeps the documents of every posting list in ascending order
+        order = np.argsort(posting_terms, kind="stable")
+        postings = np.frombuffer(posting_documents, dtype=np.int32)[order]
+        tfs = np.frombuffer(posting_tfs, dtype=np.int32)[order].astype(np.float32)
+        document_frequencies = np.bincount(posting_terms, minlength=len(term_ids))
+        term_offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(document_frequencies, out=term_offsets[1:])
+
+        document_lengths = np.frombuffer(lengths, dtype=np.int32).astype(np.float32)
+        average_length = document_lengths.mean() if len(document_lengths) else 1.0
+        count = len(document_ids)
+        idf = np.log1p((count - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+        norms = k1 * (1 - b + b * document_lengths / max(average_length, 1e-9))
+        weights = (np.repeat(idf, document_frequencies) * tfs * (k1 + 1) / (tfs + norms[postings])).astype(np.float32)
+
+        terms = [None] * len(term_ids)
+        for term, term_id in term_ids.items():
+            terms[term_id] = term
+        logger.info(f"Built a BM25 index of {count} documents, {len(terms)} terms and {len(postings)} postings.")
+        return cls(terms, document_ids, term_offsets, *encode_postings(postings, term_offsets), weights,
+                   document_lengths, k1, b, attribute)
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Message], attribute: Text = TOKEN_ATTRIBUTE_LEMM,
+                      **kwargs: Any) -> "BM25Index":
+        return cls.build(((m['id'], message_terms(m, attribute)) for m in messages), attribute=attribute, **kwargs)
+
+    @classmethod
+    def from_shards(cls, out_path: Text, attribute: Text = TOKEN_ATTRIBUTE_LEMM, **kwargs: Any) -> "BM25Index":
+        """Build an index of the messages written by the `PreProcessor` into `out_path`."""
+
+        return cls.build(((r['id'], record_terms(r, attribute)) for r in iter_records(out_path)),
+                         attribute=attribute, **kwargs)
+
+    def documents(self, term_id: int) -> np.ndarray:
+        """The ascending document numbers of the posting list of a term."""
+
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        gaps = self.postings[start:end].astype(np.int64)
+        first, last = np.searchsorted(self.exception_positions, (start, end))
+        if last > first:
+            high_bits = self.exception_values[first:last].astype(np.int64) << GAP_BITS
+            gaps[self.exception_positions[first:last] - start] += high_bits
+        return np.cumsum(gaps)
+
+    def scores(self, terms: Sequence[Text]) -> np.ndarray:
+        """The BM25 score of every document for a query."""
+
+        scores = np.zeros(len(self.document_ids), dtype=np.float32)
+        offsets = self.term_offsets
+        for term, query_tf in Counter(terms).items():
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = offsets[term_id], offsets[term_id + 1]
+            # the documents of one posting list are unique, so fancy indexing adds every weight
+            scores[self.documents(term_id)] += query_tf * self.weights[start:end]
+        return scores
+
+    def search(self, terms: Sequence[Text], k: int = 10) -> List[Tuple[Any, float]]:
+        """The `k` best matching documents of a query with their scores, the best first."""
+
+        if k <= 0:
+            return []
+        scores = self.scores(terms)
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(self.document_ids[i], float(scores[i])) for i in candidates]
+
+    def search_message(self, message: Message, k: int = 10) -> List[Tuple[Any, float]]:
+        """Search with a query message processed by the same pipeline as the documents."""
+
+        return self.search(message_terms(message, self.attribute), k)
+
+    def save(self, path: Text) -> None:
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        meta = {
+            "k1": self.k1,
+            "b": self.b,
+            "attribute": self.attribute,
+            "terms": self.terms,
+            "document_ids": self.document_ids,
+        }
+        write_text_file(json_to_string(meta, indent=None), os.path.join(path, META_FILE_NAME))
+
+    @classmethod
+    def load(cls, path: Text, mmap_mode: Optional[Text] = "r") -> "BM25Index":
+        """Load a saved index, its arrays are memory mapped unless `mmap_mode` is `None`."""
+
+        meta = read_json_file(os.path.join(path, META_FILE_NAME))
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(meta["terms"], meta["document_ids"], k1=meta["k1"], b=meta["b"], attribute=meta["attribute"],
+                   **arrays)
@@ -0,0 +1,151 @@
+import logging
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Text
+
+from shpachatbot.io import json_to_string, read_json_file, write_text_file
+
+logger = logging.getLogger(__name__)
+
+
+class LookupCache:
+    """Memoizes a string lookup, e.g. a stemmer, in a bounded LRU cache.
+
+    Calling the cache with a key returns the cached value or computes it with
+    `func`. When more than `max_size` keys are stored the least recently used
+    one is evicted. A `max_size` of zero disables caching. A cache without
+    `func` is filled with `update` and read with `get`.
+    """
+
+    def __init__(self, func: Optional[Callable[[Text], Any]] = None, max_size: int = 100000) -> None:
+        self._func = func
+        self._items = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, key: Text) -> Any:
+        items = self._items
+        if key in items:
+            self.hits += 1
+            items.move_to_end(key)
+            return items[key]
+
+        self.misses += 1
+        value = self._func(key)
+        if self.max_size > 0:
+            items[key] = value
+            if len(items) > self.max_size:
+                items.popitem(last=False)
+        return value
+
+    def get(self, key: Text, default: Any = None) -> Any:
+        """Look up a key without computing a missing value, the lookup is counted."""
+
+        items = self._items
+        if key in items:
+            self.hits += 1
+            items.move_to_end(key)
+            return items[key]
+        self.misses += 1
+        return default
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+    def as_dict(self) -> Dict[Text, Any]:
+        """The cached items, from the least to the most recently used."""
+
+        return dict(self._items)
+
+    def update(self, items: Dict[Text, Any]) -> None:
+        """Add items to the cache without counting them as lookups."""
+
+        for key, value in items.items():
+            self._items[key] = value
+            self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+def load_caches(cache_path: Optional[Text], **caches: LookupCache) -> None:
+    """Warm `caches` with the items saved by `save_caches` under their names."""
+
+    if not cache_path or not os.path.exists(cache_path):
+        return
+
+    saved = read_json_file(cache_path)
+    for name, cache in caches.items():
+        cache.update(saved.get(name, {}))
+    logger.debug(f"Loaded lookup caches from '{cache_path}'.")
+
+
+@contextmanager
+def _file_lock(lock_path: Text) -> Iterator[None]:
+    """Hold an exclusive lock of a file, processes wait for each other."""
+
+    with open(lock_path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+
+            # retries for 10 seconds before it raises
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _merge_items(saved: Dict[Text, Any], cache: LookupCache) -> Dict[Text, Any]:
+    # the items of the cache are the most recently used, the saved items are evicted first
+    items = OrderedDict(saved)
+    for key, value in cache.as_dict().items():
+        items[key] = value
+        items.move_to_end(key)
+    while len(items) > cache.max_size:
+        items.popitem(last=False)
+    return dict(items)
+
+
+def save_caches(cache_path: Text, **caches: LookupCache) -> None:
+    """Save the items of `caches` to a json file keyed by their names.
+
+    The items are merged with those already saved at the path, e.g. by
+    other workers or components, under a lock of `<cache_path>.lock`. The
+    file is replaced atomically, so readers never see a partially written
+    file.
+    """
+    with _file_lock(f"{cache_path}.lock"):
+        saved = read_json_file(cache_path) if os.path.exists(cache_path) else {}
+        for name, cache in caches.items():
+            saved[name] = _merge_items(saved.get(name, {}), cache)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        write_text_file(json_to_string(saved, indent=None), temp_path)
+        os.replace(temp_path, cache_path)
+    for name, cache in caches.items():
+        logger.debug(f"Saved lookup cache '{name}' to '{cache_path}': {cache.stats}")
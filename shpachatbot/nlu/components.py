@@ -2,16 +2,46 @@ import logging
 from abc import abstractmethod
 from typing import List, Type, Optional, Dict, Any, Text, Tuple
 
-from pyrsistent import typing
-
 from shpachatbot.config import NLUModelConfig
+from shpachatbot.exceptions import InvalidConfigException
 from shpachatbot.nlu.models import Message
 from shpachatbot.utils import override_defaults
 
 logger = logging.getLogger(__name__)
 
 
+def validate_required_components(pipeline: List["Component"]) -> None:
+    """Validates that all required components are present in the pipeline.
+
+    Args:
+        pipeline: The list of the components.
+
+    Raises:
+        InvalidConfigException: If a required component is missing or comes
+            after the component that requires it.
+    """
+    for idx, component in enumerate(pipeline):
+        preceding_components = {type(c).__name__ for c in pipeline[:idx]}
+        missing_components = [
+            required.__name__
+            for required in component.required_components()
+            if required.__name__ not in preceding_components
+        ]
+        if missing_components:
+            missing_components_str = ", ".join(f"'{c}'" for c in missing_components)
+            raise InvalidConfigException(
+                f"The pipeline configuration contains errors. The component "
+                f"'{component.name}' requires {missing_components_str} to be "
+                f"placed before it in the pipeline. Please add the required "
+                f"components to the pipeline."
+            )
+
+
 class Component:
+    # increase when a change of the component changes its output,
+    # it is part of the pipeline fingerprint
+    version = 1
+
     @property
     def name(self) -> Text:
         """Access the class's property name from an instance."""
@@ -52,6 +82,28 @@ class Component:
     ) -> "Component":
         return cls(component_config)
 
+    def persist(self) -> None:
+        """Persist the state of this component to disk, if it has any."""
+
+        pass
+
     @abstractmethod
     def process(self, message: Message, **kwargs: Any) -> None:
         raise NotImplementedError
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> Optional[List[Message]]:
+        """Process a batch of messages.
+
+        The default implementation calls `process` for every message. Components
+        should override it when work can be shared between the messages of a batch.
+
+        Args:
+            messages: The messages to process.
+            kwargs: Passed to `process`.
+
+        Returns:
+            `None` or, for components which filter messages, the messages
+            which continue through the pipeline.
+        """
+        for message in messages:
+            self.process(message, **kwargs)
@@ -0,0 +1,250 @@
+import hashlib
+import logging
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Text
+
+import numpy as np
+
+from shpachatbot.constants import TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM
+from shpachatbot.io import json_to_string, read_json_file, write_text_file
+from shpachatbot.nlu.models import Message
+from shpachatbot.nlu.vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+META_FILE_NAME = "meta.json"
+VOCABULARY_FILE_NAME = "vocabulary.json"
+SENTENCE_OFFSETS_FILE_NAME = "sentence_offsets.i64"
+MESSAGE_OFFSETS_FILE_NAME = "message_offsets.i64"
+MESSAGE_IDS_FILE_NAME = "message_ids.utf8"
+MESSAGE_ID_OFFSETS_FILE_NAME = "message_id_offsets.i64"
+MESSAGE_ID_HASHES_FILE_NAME = "message_id_hashes.u64"
+MESSAGE_ID_ORDER_FILE_NAME = "message_id_order.i64"
+
+ID_DTYPE = np.int32
+OFFSET_DTYPE = np.int64
+HASH_DTYPE = np.uint64
+
+
+def _ids_file_name(attribute: Text) -> Text:
+    return f"{attribute}.ids.i32"
+
+
+def _message_id_hash(message_id: Text) -> int:
+    # stable between processes, unlike the builtin `hash` of strings
+    return int.from_bytes(hashlib.blake2b(message_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class CorpusWriter:
+    """Writes processed messages into a memory-mappable corpus directory.
+
+    The tokens of every attribute are encoded with one `Vocabulary` and
+    appended to a flat int32 file per attribute, all attributes share the
+    token positions. `sentence_offsets` holds the first token of every
+    sentence and `message_offsets` the first sentence of every message, both
+    end with the total count. The message ids are stored as utf-8 strings
+    with their offsets, together with their sorted 64 bit hashes and the
+    positions of the messages in hash order, which `CorpusStore` searches
+    to find a message by its id. All files are written while streaming,
+    only the hashes of the ids are kept in memory.
+
+    Without a vocabulary an empty one is created and grows with the written
+    messages, new forms always get new ids at the end, so the ids of written
+    tokens stay valid.
+    """
+
+    def __init__(
+            self,
+            path: Text,
+            vocabulary: Optional[Vocabulary] = None,
+            attributes: Sequence[Text] = (TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM),
+            grow_vocabulary: Optional[bool] = None,
+    ) -> None:
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self._grow_vocabulary = vocabulary is None if grow_vocabulary is None else grow_vocabulary
+        self._attributes = list(attributes)
+        self._ids_files = {a: open(os.path.join(path, _ids_file_name(a)), 'wb') for a in self._attributes}
+        self._sentence_offsets = open(os.path.join(path, SENTENCE_OFFSETS_FILE_NAME), 'wb')
+        self._message_offsets = open(os.path.join(path, MESSAGE_OFFSETS_FILE_NAME), 'wb')
+        self._message_ids = open(os.path.join(path, MESSAGE_IDS_FILE_NAME), 'wb')
+        self._message_id_offsets = open(os.path.join(path, MESSAGE_ID_OFFSETS_FILE_NAME), 'wb')
+        self._message_id_hashes = []
+        self._message_id_bytes = 0
+        self._token_count = 0
+        self._sentence_count = 0
+        self._sentence_offsets.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        self._message_offsets.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        self._message_id_offsets.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+
+    def write(self, message: Message) -> None:
+        sentences = message.sentences
+        if self._grow_vocabulary:
+            for sentence in sentences:
+                for attribute in self._attributes:
+                    self._vocabulary.extend(f for f in sentence.token_attribute(attribute) if f is not None)
+
+        offsets = np.empty(len(sentences), dtype=OFFSET_DTYPE)
+        for idx, sentence in enumerate(sentences):
+            for attribute in self._attributes:
+                self._ids_files[attribute].write(self._vocabulary.encode_sentence(sentence, attribute).tobytes())
+            self._token_count += len(sentence)
+            offsets[idx] = self._token_count
+        self._sentence_offsets.write(offsets.tobytes())
+        self._sentence_count += len(sentences)
+        self._message_offsets.write(np.array([self._sentence_count], dtype=OFFSET_DTYPE).tobytes())
+        message_id = str(message['id'])
+        encoded = message_id.encode("utf-8")
+        self._message_ids.write(encoded)
+        self._message_id_bytes += len(encoded)
+        self._message_id_offsets.write(np.array([self._message_id_bytes], dtype=OFFSET_DTYPE).tobytes())
+        self._message_id_hashes.append(_message_id_hash(message_id))
+
+    def write_all(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            self.write(message)
+
+    def close(self) -> None:
+        for f in [*self._ids_files.values(), self._sentence_offsets, self._message_offsets,
+                  self._message_ids, self._message_id_offsets]:
+            f.close()
+        hashes = np.array(self._message_id_hashes, dtype=HASH_DTYPE)
+        order = np.argsort(hashes, kind="stable").astype(OFFSET_DTYPE)
+        hashes[order].tofile(os.path.join(self._path, MESSAGE_ID_HASHES_FILE_NAME))
+        order.tofile(os.path.join(self._path, MESSAGE_ID_ORDER_FILE_NAME))
+        self._vocabulary.save(os.path.join(self._path, VOCABULARY_FILE_NAME))
+        meta = {
+            "attributes": self._attributes,
+            "messages": len(hashes),
+            "sentences": self._sentence_count,
+            "tokens": self._token_count,
+            "message_id_bytes": self._message_id_bytes,
+        }
+        write_text_file(json_to_string(meta), os.path.join(self._path, META_FILE_NAME))
+        logger.info(f"Wrote a corpus of {len(hashes)} messages and {self._token_count} tokens "
+                    f"to '{self._path}'.")
+
+    def __enter__(self) -> "CorpusWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def build_corpus(
+        messages: Iterable[Message],
+        path: Text,
+        vocabulary: Optional[Vocabulary] = None,
+        attributes: Sequence[Text] = (TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM),
+) -> "CorpusStore":
+    """Write processed messages, e.g. `serialization.iter_messages` of a shard directory, into a corpus."""
+
+    with CorpusWriter(path, vocabulary, attributes) as writer:
+        writer.write_all(messages)
+    return CorpusStore(path)
+
+
+class CorpusStore:
+    """Random access to a corpus written by `CorpusWriter`.
+
+    All arrays are read-only `numpy.memmap`s, so opening a corpus reads
+    nothing but the metadata and the vocabulary, readers in several
+    processes share the pages of the files through the page cache, and
+    every returned array of token ids is a view into the mapped file.
+    Message ids are found by a binary search of their hashes.
+    """
+
+    def __init__(self, path: Text) -> None:
+        self._path = path
+        meta = read_json_file(os.path.join(path, META_FILE_NAME))
+        self.attributes: List[Text] = meta["attributes"]
+        self.vocabulary = Vocabulary(forms=read_json_file(os.path.join(path, VOCABULARY_FILE_NAME)))
+        self._ids = {a: self._map(_ids_file_name(a), ID_DTYPE, meta["tokens"]) for a in self.attributes}
+        self.sentence_offsets = self._map(SENTENCE_OFFSETS_FILE_NAME, OFFSET_DTYPE, meta["sentences"] + 1)
+        self.message_offsets = self._map(MESSAGE_OFFSETS_FILE_NAME, OFFSET_DTYPE, meta["messages"] + 1)
+        self._message_ids = self._map(MESSAGE_IDS_FILE_NAME, np.uint8, meta["message_id_bytes"])
+        self._message_id_offsets = self._map(MESSAGE_ID_OFFSETS_FILE_NAME, OFFSET_DTYPE, meta["messages"] + 1)
+        self._message_id_hashes = self._map(MESSAGE_ID_HASHES_FILE_NAME, HASH_DTYPE, meta["messages"])
+        self._message_id_order = self._map(MESSAGE_ID_ORDER_FILE_NAME, OFFSET_DTYPE, meta["messages"])
+
+    def _map(self, file_name: Text, dtype: Any, length: int) -> np.ndarray:
+        if length == 0:
+            # an empty file can not be mapped
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self._path, file_name), dtype=dtype, mode='r', shape=(length,))
+
+    def __len__(self) -> int:
+        return len(self.message_offsets) - 1
+
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentence_offsets) - 1
+
+    def token_ids(self, attribute: Text = TEXT) -> np.ndarray:
+        """The ids of all tokens of the corpus."""
+
+        return self._ids[attribute]
+
+    def message_id(self, idx: int) -> Text:
+        """The id of the message at position `idx`."""
+
+        start, end = self._message_id_offsets[idx], self._message_id_offsets[idx + 1]
+        return self._message_ids[start:end].tobytes().decode("utf-8")
+
+    @property
+    def message_ids(self) -> List[Text]:
+        return [self.message_id(idx) for idx in range(len(self))]
+
+    def message_index(self, message_id: Any) -> int:
+        """The position of a message by its id.
+
+        Raises:
+            KeyError: If no message has the id.
+        """
+        message_id = str(message_id)
+        message_hash = HASH_DTYPE(_message_id_hash(message_id))
+        hashes = self._message_id_hashes
+        position = int(np.searchsorted(hashes, message_hash))
+        # hashes may collide, the candidates are compared by their ids
+        while position < len(hashes) and hashes[position] == message_hash:
+            idx = int(self._message_id_order[position])
+            if self.message_id(idx) == message_id:
+                return idx
+            position += 1
+        raise KeyError(message_id)
+
+    def message(self, idx: int, attribute: Text = TEXT) -> np.ndarray:
+        """The token ids of the message at position `idx`."""
+
+        first_sentence, end_sentence = self.message_offsets[idx], self.message_offsets[idx + 1]
+        return self._ids[attribute][self.sentence_offsets[first_sentence]:self.sentence_offsets[end_sentence]]
+
+    def get(self, message_id: Any, attribute: Text = TEXT) -> np.ndarray:
+        """The token ids of a message by its id."""
+
+        return self.message(self.message_index(message_id), attribute)
+
+    def sentence(self, idx: int, attribute: Text = TEXT) -> np.ndarray:
+        """The token ids of the sentence at position `idx` of the corpus."""
+
+        return self._ids[attribute][self.sentence_offsets[idx]:self.sentence_offsets[idx + 1]]
+
+    def message_sentences(self, idx: int, attribute: Text = TEXT) -> List[np.ndarray]:
+        return [self.sentence(s, attribute) for s in range(self.message_offsets[idx], self.message_offsets[idx + 1])]
+
+    def iter_sentences(self, attribute: Text = TEXT) -> Iterator[np.ndarray]:
+        ids, offsets = self._ids[attribute], self.sentence_offsets
+        for idx in range(self.sentence_count):
+            yield ids[offsets[idx]:offsets[idx + 1]]
+
+    def decode(self, ids: Iterable[int]) -> List[Text]:
+        return self.vocabulary.decode(ids)
+
+    def stats(self) -> Dict[Text, int]:
+        return {
+            "messages": len(self),
+            "sentences": self.sentence_count,
+            "tokens": int(self.sentence_offsets[-1]) if self.sentence_count else 0,
+            "vocabulary": len(self.vocabulary),
+        }
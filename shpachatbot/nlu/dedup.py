@@ -0,0 +1,293 @@
+import logging
+import re
+import sqlite3
+import zlib
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+import numpy as np
+
+from shpachatbot.exceptions import InvalidConfigException
+from shpachatbot.nlu.components import Component
+from shpachatbot.nlu.models import Message
+from shpachatbot.utils import get_text_hash
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_ACTIONS = ("drop", "link")
+
+# a prime above 2**32, so `(a * h + b) % PRIME` of 32 bit hashes never overflows uint64
+PRIME = np.uint64((1 << 32) + 15)
+MAX_HASH = (1 << 32) - 1
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: Text, size: int = 5) -> List[Text]:
+    """The overlapping word n-grams of `size` words of a text, the text itself if it is shorter."""
+
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[idx:idx + size]) for idx in range(len(words) - size + 1)]
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Choose the number of bands and rows per band of a MinHash LSH index.
+
+    Two signatures with a jaccard similarity `s` share a bucket with the
+    probability `1 - (1 - s**rows)**bands`, the steepest rise of this curve
+    is at about `(1 / bands)**(1 / rows)`. The chosen split puts it just below
+    `threshold`, candidates are verified against the threshold afterwards.
+    """
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [c for c in candidates if (1 / c[0]) ** (1 / c[1]) <= threshold]
+    return max(below or candidates[:1], key=lambda c: (1 / c[0]) ** (1 / c[1]))
+
+
+class MinHasher:
+    """Computes MinHash signatures of sets of shingles.
+
+    Shingles are hashed with crc32, the `num_perm` permutations are the
+    universal hash functions `(a * h + b) % PRIME` with coefficients drawn
+    from `seed`, all evaluated at once with NumPy.
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1) -> None:
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: List[Text]) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set), dtype=np.uint64,
+                             count=len(shingle_set))
+        return ((np.outer(hashes, self._a) + self._b) % PRIME).min(axis=0)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """The estimated jaccard similarity of the shingle sets of two signatures."""
+
+        return float(np.count_nonzero(first == second)) / len(first)
+
+
+class SignatureIndex:
+    """Persistent index of the content hashes and MinHash signatures of messages.
+
+    Exact duplicates are found by the sha1 of the normalized text, near
+    duplicates by the LSH buckets of the signature: every band of `rows`
+    values is one bucket key. The index is a SQLite database, several worker
+    processes can share it, a worker sees the messages of the others once
+    they are committed.
+    """
+
+    def __init__(
+            self,
+            index_path: Optional[Text],
+            num_perm: int,
+            bands: int,
+            params: Dict[Text, Any],
+            commit_every: int = 1000,
+    ) -> None:
+        # components are never used by two threads at once, but the server runs them in a background thread
+        self._connection = sqlite3.connect(index_path or ":memory:", timeout=60, check_same_thread=False)
+        if index_path:
+            # readers do not block the writer of another worker
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS params (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS hashes (content_hash TEXT PRIMARY KEY, message_id TEXT);"
+            "CREATE TABLE IF NOT EXISTS signatures (message_id TEXT PRIMARY KEY, content_hash TEXT, signature BLOB);"
+            "CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket BLOB, message_id TEXT);"
+            "CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, bucket);"
+        )
+        self._check_params({key: str(value) for key, value in params.items()})
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._commit_every = commit_every
+        self._pending = 0
+
+    def _check_params(self, params: Dict[Text, Text]) -> None:
+        stored = dict(self._connection.execute("SELECT key, value FROM params").fetchall())
+        if not stored:
+            self._connection.executemany("INSERT INTO params (key, value) VALUES (?, ?)", params.items())
+            self._connection.commit()
+        elif stored != params:
+            raise InvalidConfigException(
+                f"The signature index was built with {stored}, its signatures can not be compared "
+                f"to signatures of {params}."
+            )
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def indexed_hash(self, message_id: Text) -> Optional[Text]:
+        """The content hash of a message if it is indexed."""
+
+        row = self._connection.execute(
+            "SELECT content_hash FROM signatures WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def find_exact(self, content_hash: Text) -> Optional[Text]:
+        row = self._connection.execute(
+            "SELECT message_id FROM hashes WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else None
+
+    def find_similar(self, message_id: Text, signature: np.ndarray, threshold: float) -> Optional[Tuple[Text, float]]:
+        """The most similar indexed message with a similarity of at least `threshold`."""
+
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(row[0] for row in self._connection.execute(
+                "SELECT message_id FROM buckets WHERE band = ? AND bucket = ?", (band, key)))
+        candidates.discard(message_id)
+
+        best = None
+        for candidate in sorted(candidates):
+            row = self._connection.execute(
+                "SELECT signature FROM signatures WHERE message_id = ?", (candidate,)).fetchone()
+            similarity = MinHasher.similarity(signature, np.frombuffer(row[0], dtype=np.uint64))
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+    def add(self, message_id: Text, content_hash: Text, signature: np.ndarray) -> None:
+        # a message processed again replaces its old entries
+        self.remove(message_id)
+        self._connection.execute(
+            "INSERT OR IGNORE INTO hashes (content_hash, message_id) VALUES (?, ?)", (content_hash, message_id))
+        self._connection.execute(
+            "INSERT INTO signatures (message_id, content_hash, signature) VALUES (?, ?, ?)",
+            (message_id, content_hash, signature.tobytes()))
+        self._connection.executemany(
+            "INSERT INTO buckets (band, bucket, message_id) VALUES (?, ?, ?)",
+            [(band, key, message_id) for band, key in enumerate(self._band_keys(signature))])
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.commit()
+
+    def remove(self, message_id: Text) -> None:
+        for table in ("hashes", "signatures", "buckets"):
+            self._connection.execute(f"DELETE FROM {table} WHERE message_id = ?", (message_id,))
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def commit(self) -> None:
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._connection.close()
+
+
+class DuplicateFilter(Component):
+    """Finds pages whose text repeats a page seen before.
+
+    Meant to run right after the normalizer, before the tokenizer, so
+    duplicated pages never reach the expensive components. A page is an
+    exact duplicate if the sha1 of its normalized words is indexed already,
+    a near duplicate if the estimated jaccard similarity of its word
+    shingles to an indexed page is at least `threshold`. The `link_key`
+    property of a duplicate holds the id of the page it repeats, with the
+    action `drop` duplicates are removed from the batch, with `link` they
+    are kept.
+    Unique pages are added to the signature index, with `index_path` the
+    index persists between runs and is shared by the workers. The index is
+    committed after every batch, two copies processed by different workers
+    at the same time may both be kept.
+    """
+
+    defaults = {
+        "threshold": 0.8,
+        "action": "drop",
+        "link_key": "duplicate_of",
+        "shingle_size": 5,
+        "num_perm": 128,
+        # the number of LSH bands, chosen from the threshold if omitted
+        "bands": None,
+        "seed": 1,
+        "index_path": None,
+        "commit_every": 1000,
+    }
+
+    def __init__(self, component_config: Dict[Text, Any] = None) -> None:
+        super().__init__(component_config)
+        config = self.component_config
+        if config.action not in DUPLICATE_ACTIONS:
+            raise InvalidConfigException(
+                f"Unknown duplicate action '{config.action}', use one of: {', '.join(DUPLICATE_ACTIONS)}.")
+        bands = config.bands or lsh_bands(config.num_perm, config.threshold)[0]
+        if config.num_perm % bands:
+            raise InvalidConfigException(f"num_perm {config.num_perm} is not divisible into {bands} bands.")
+
+        self._hasher = MinHasher(config.num_perm, config.seed)
+        self._index = SignatureIndex(
+            config.index_path, config.num_perm, bands,
+            {"num_perm": config.num_perm, "bands": bands, "seed": config.seed, "shingle_size": config.shingle_size},
+            config.commit_every,
+        )
+        self.counts = {"unique": 0, "exact": 0, "near": 0}
+
+    @classmethod
+    def required_packages(cls) -> List[Text]:
+        return ['numpy']
+
+    def _find_duplicate(self, message: Message) -> Optional[Text]:
+        message_id = str(message['id']) if message['id'] is not None else None
+        shingle_set = shingles(message.text, self.component_config.shingle_size)
+        if not shingle_set:
+            self.counts["unique"] += 1
+            return None
+
+        content_hash = get_text_hash(' '.join(_WORD_RE.findall(message.text.lower())))
+        if message_id is not None and self._index.indexed_hash(message_id) == content_hash:
+            # an unchanged page which is indexed already stays unique when it is processed again
+            self.counts["unique"] += 1
+            return None
+        # messages without an id, e.g. utterances, are indexed by their content
+        message_id = message_id or content_hash
+
+        duplicate = self._index.find_exact(content_hash)
+        if duplicate is not None:
+            self.counts["exact"] += 1
+            return duplicate
+
+        signature = self._hasher.signature(shingle_set)
+        similar = self._index.find_similar(message_id, signature, self.component_config.threshold)
+        if similar is not None:
+            self.counts["near"] += 1
+            return similar[0]
+
+        self._index.add(message_id, content_hash, signature)
+        self.counts["unique"] += 1
+        return None
+
+    def process(self, message: Message, **kwargs: Any) -> Optional[Message]:
+        """Check a single message.
+
+        Returns:
+            The message, `None` if it is a duplicate and the action is `drop`.
+        """
+        kept = self.process_batch([message], **kwargs)
+        return kept[0] if kept else None
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> List[Message]:
+        link_key = self.component_config.link_key
+        keep_duplicates = self.component_config.action == "link"
+        kept = []
+        for message in messages:
+            duplicate = self._find_duplicate(message)
+            if duplicate is not None:
+                message[link_key] = duplicate
+            if duplicate is None or keep_duplicates:
+                kept.append(message)
+        # other workers only see committed pages
+        self._index.commit()
+        return kept
+
+    def persist(self) -> None:
+        self._index.commit()
+        logger.info(f"Duplicate filter: {self.counts['unique']} unique, {self.counts['exact']} exact and "
+                    f"{self.counts['near']} near duplicate messages.")
@@ -0,0 +1,158 @@
+import logging
+import os
+import uuid
+import zlib
+from typing import Any, Dict, Iterator, List, Text, Tuple, Type
+
+import numpy as np
+import scipy.sparse
+
+from shpachatbot.constants import TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM
+from shpachatbot.nlu.cache import LookupCache
+from shpachatbot.nlu.components import Component
+from shpachatbot.nlu.models import Message, Sentence
+from shpachatbot.nlu.tokenizers.hazm import HazmTokenizer
+
+logger = logging.getLogger(__name__)
+
+FEATURES_FILE_PREFIX = "features-"
+
+
+def _hash_feature(feature: Text) -> int:
+    # crc32 is stable between processes, unlike the builtin `hash` of strings
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+def _sentence_values(sentence: Sentence, attribute: Text) -> List[Text]:
+    values = sentence.token_attribute(attribute)
+    return [v if v is not None else t for v, t in zip(values, sentence.token_texts)]
+
+
+class HashingFeaturizer(Component):
+    """Turns the tokens of messages into fixed-width hashed sparse vectors.
+
+    Every value of the configured token attributes and every n-gram of
+    `min_n` to `max_n` values is hashed into one of `n_features` columns,
+    no vocabulary is kept. A batch of messages becomes one CSR matrix, each
+    message gets its row as `message.features`. With `features_path` the
+    matrices are also collected and written as shards of `max_shard_rows`
+    rows, together with the ids of the messages, which
+    `iter_feature_shards` reads back one shard at a time.
+    """
+
+    defaults = {
+        "n_features": 2 ** 20,
+        "attributes": [TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM],
+        "min_n": 1,
+        "max_n": 2,
+        # the sign of a feature is derived from its hash, so collisions tend to cancel out
+        "alternate_sign": True,
+        "norm": "l2",
+        "cache_size": 100000,
+        "features_path": None,
+        "max_shard_rows": 100000,
+    }
+
+    def __init__(self, component_config: Dict[Text, Any] = None) -> None:
+        super().__init__(component_config)
+        self._hash = LookupCache(_hash_feature, self.component_config.cache_size)
+        self._pending = []
+        self._pending_ids = []
+        self._pending_rows = 0
+        self._name = f"{FEATURES_FILE_PREFIX}{uuid.uuid4().hex[:12]}"
+        self._shard_no = 0
+
+    @classmethod
+    def required_components(cls) -> List[Type[Component]]:
+        return [HazmTokenizer]
+
+    @classmethod
+    def required_packages(cls) -> List[Text]:
+        return ['numpy', 'scipy']
+
+    def _message_features(self, message: Message) -> List[Text]:
+        min_n, max_n = self.component_config.min_n, self.component_config.max_n
+        features = []
+        for sentence in message.sentences:
+            for attribute in self.component_config.attributes:
+                values = _sentence_values(sentence, attribute)
+                for n in range(min_n, max_n + 1):
+                    if n > len(values):
+                        break
+                    features.extend(f"{attribute}:{' '.join(g)}" for g in zip(*(values[i:] for i in range(n))))
+        return features
+
+    def featurize(self, messages: List[Message]) -> scipy.sparse.csr_matrix:
+        """The hashed feature matrix of a batch of messages, one row per message."""
+
+        n_features = self.component_config.n_features
+        hashes = []
+        indptr = np.zeros(len(messages) + 1, dtype=np.int64)
+        hash_feature = self._hash
+        for idx, message in enumerate(messages):
+            hashes.extend(hash_feature(f) for f in self._message_features(message))
+            indptr[idx + 1] = len(hashes)
+
+        hashes = np.array(hashes, dtype=np.uint32)
+        indices = (hashes % n_features).astype(np.int32)
+        if self.component_config.alternate_sign:
+            data = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        else:
+            data = np.ones(len(hashes), dtype=np.float32)
+
+        matrix = scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(messages), n_features))
+        matrix.sum_duplicates()
+        if self.component_config.norm == "l2":
+            rows = np.repeat(np.arange(len(messages)), np.diff(matrix.indptr))
+            norms = np.sqrt(np.bincount(rows, weights=matrix.data ** 2, minlength=len(messages)))
+            norms[norms == 0] = 1.0
+            matrix.data /= norms[rows].astype(np.float32)
+        return matrix
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        self.process_batch([message], **kwargs)
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> None:
+        matrix = self.featurize(messages)
+        for idx, message in enumerate(messages):
+            message.features = matrix[idx]
+
+        if self.component_config.features_path:
+            self._pending.append(matrix)
+            self._pending_ids.extend(m['id'] for m in messages)
+            self._pending_rows += len(messages)
+            if self._pending_rows >= self.component_config.max_shard_rows:
+                self._write_shard()
+
+    def _write_shard(self) -> None:
+        features_path = self.component_config.features_path
+        os.makedirs(features_path, exist_ok=True)
+        matrix = scipy.sparse.vstack(self._pending, format="csr")
+        path = os.path.join(features_path, f"{self._name}-{self._shard_no:05d}.npz")
+        # the layout of `scipy.sparse.save_npz`, so `scipy.sparse.load_npz` reads the shard as well
+        np.savez(path, format=b"csr", shape=matrix.shape, data=matrix.data, indices=matrix.indices,
+                 indptr=matrix.indptr, ids=np.array(self._pending_ids, dtype=str))
+        logger.debug(f"Saved the features of {matrix.shape[0]} messages to '{path}'.")
+        self._shard_no += 1
+        self._pending = []
+        self._pending_ids = []
+        self._pending_rows = 0
+
+    def persist(self) -> None:
+        if self._pending_rows:
+            self._write_shard()
+
+
+def iter_feature_shards(features_path: Text) -> Iterator[Tuple[List[Text], scipy.sparse.csr_matrix]]:
+    """Iterate over the feature shards of a directory, e.g. to train a classifier with `partial_fit`.
+
+    Yields:
+        The message ids and the feature matrix of one shard.
+    """
+    for file_name in sorted(os.listdir(features_path)):
+        if not (file_name.startswith(FEATURES_FILE_PREFIX) and file_name.endswith(".npz")):
+            continue
+        with np.load(os.path.join(features_path, file_name)) as shard:
+            matrix = scipy.sparse.csr_matrix((shard["data"], shard["indices"], shard["indptr"]),
+                                             shape=tuple(shard["shape"]))
+            yield shard["ids"].tolist(), matrix
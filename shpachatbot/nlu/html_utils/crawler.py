@@ -1,10 +1,20 @@
+import asyncio
 import datetime
+import hashlib
+import logging
 import os
+import re
+from collections import Counter
 from concurrent import futures
 
+import aiohttp
 import requests
 from tqdm import tqdm
 
+from shpachatbot.nlu.html_utils.manifest import CrawlManifest, CONTENT_STATUSES
+
+logger = logging.getLogger(__name__)
+
 
 class Crawler:
     def __init__(self, base_url, idx_gen, output_path):
@@ -21,7 +31,7 @@ class Crawler:
         # print(page_id)
         url = self._base_url.format(page_id=page_id)
         output_path = os.path.join(self._output_path, str(page_id.replace('/', '-')))
-        if page_id in self._download_pages:
+        if os.path.basename(output_path) in self._download_pages:
             return True
         try:
             response = requests.get(url, headers=self._default_headers)
@@ -43,19 +53,225 @@ class Crawler:
         self._download_all(workers)
 
 
+class LinkExtractor:
+    """Discovers pages to crawl in the links of fetched pages.
+
+    The hrefs of a fetched page are found with a regular expression on the raw
+    body, without parsing the document. Every href matching `pattern` links
+    to the page whose id is captured by the first group of the pattern. Those
+    pages are downloaded from `base_url` into `output_path`.
+    """
+
+    _href_pattern = re.compile(rb'href\s*=\s*["\']([^"\'>]+)["\']', re.IGNORECASE)
+
+    def __init__(self, pattern, base_url, output_path, manifest_path=None):
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.base_url = base_url
+        self.output_path = output_path
+        self.manifest_path = manifest_path
+
+    def extract(self, body):
+        for href in self._href_pattern.finditer(body):
+            match = self.pattern.match(href.group(1).decode('utf-8', 'ignore'))
+            if match:
+                yield match.group(1)
+
+
+class _CrawlTarget:
+    """Where pages of one kind are downloaded from and stored, with their manifest."""
+
+    def __init__(self, base_url, output_path, manifest_path=None):
+        self.base_url = base_url
+        self.output_path = output_path
+        self.manifest_path = manifest_path or f"{os.path.normpath(output_path)}.manifest.sqlite"
+        self.manifest = None
+
+    def open(self):
+        is_new_manifest = not os.path.exists(self.manifest_path)
+        self.manifest = CrawlManifest(self.manifest_path)
+        if is_new_manifest:
+            self.manifest.import_directory(self.output_path)
+
+    def close(self):
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+
+class AsyncCrawler:
+    """Downloads pages with asyncio over pooled keep-alive connections.
+
+    At most `concurrency` requests are in flight, `per_host_concurrency` of
+    them to the same host. Failed requests, server errors and 429 responses
+    are retried with exponential backoff. Response bodies are streamed to
+    disk as they arrive and written byte by byte as the server sent them.
+
+    Fetched pages are recorded in a `CrawlManifest`, by default next to the
+    output directory. Pages with stored content are skipped, or with
+    `recrawl` requested again with their `ETag`/`Last-Modified` validators
+    so that unchanged pages are answered with 304 Not Modified.
+
+    With a `link_extractor` the pages of `idx_gen` are scanned for links while
+    they are crawled. Newly discovered pages are added to the persistent
+    seen-set of their manifest and queued right away, so discovery and
+    download of e.g. archive and post pages overlap. Pages discovered by an
+    interrupted crawl are queued again when the next crawl starts.
+    """
+
+    def __init__(self, base_url, idx_gen, output_path, concurrency=64, per_host_concurrency=16,
+                 timeout=30, retries=3, backoff=0.5, chunk_size=64 * 1024, headers=None,
+                 manifest_path=None, recrawl=False, link_extractor=None):
+        self._headers = headers or {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:47.0) Gecko/20100101 Firefox/47.0'
+        }
+        self._idx_gen = idx_gen
+        self._concurrency = concurrency
+        self._per_host_concurrency = per_host_concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._chunk_size = chunk_size
+        self._recrawl = recrawl
+        self._seed_target = _CrawlTarget(base_url, output_path, manifest_path)
+        self._link_extractor = link_extractor
+        self._link_target = None
+        if link_extractor is not None:
+            self._link_target = _CrawlTarget(link_extractor.base_url, link_extractor.output_path,
+                                             link_extractor.manifest_path)
+        self._stats = Counter()
+
+    @staticmethod
+    def _file_name(page_id):
+        return str(page_id).replace('/', '-')
+
+    @staticmethod
+    def _read_stored(output_path):
+        try:
+            with open(output_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            logger.warning(f"The stored page '{output_path}' can not be read, its links are not extracted.")
+            return None
+
+    async def _download_single(self, session, target, page_id, keep_body=False):
+        """Download a page, returns the final status and, with `keep_body`, its content.
+
+        The content of skipped and not modified pages is read from the stored
+        file, so links are extracted from pages crawled before as well.
+        """
+        file_name = self._file_name(page_id)
+        output_path = os.path.join(target.output_path, file_name)
+        record = target.manifest.get(file_name)
+        has_content = record is not None and record['status'] in CONTENT_STATUSES
+        if has_content and not self._recrawl:
+            return 'skipped', self._read_stored(output_path) if keep_body else None
+
+        headers = {}
+        if has_content:
+            if record['etag']:
+                headers['If-None-Match'] = record['etag']
+            if record['last_modified']:
+                headers['If-Modified-Since'] = record['last_modified']
+
+        url = target.base_url.format(page_id=page_id)
+        for attempt in range(self._retries + 1):
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 200:
+                        content_hash = hashlib.sha1()
+                        body = bytearray() if keep_body else None
+                        temp_path = f"{output_path}.part"
+                        with open(temp_path, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(self._chunk_size):
+                                content_hash.update(chunk)
+                                f.write(chunk)
+                                if keep_body:
+                                    body += chunk
+                        os.replace(temp_path, output_path)
+                        target.manifest.record(file_name, url, response.status,
+                                               content_hash=content_hash.hexdigest(),
+                                               etag=response.headers.get('ETag'),
+                                               last_modified=response.headers.get('Last-Modified'))
+                        return response.status, body
+                    if response.status < 500 and response.status != 429:
+                        target.manifest.record(file_name, url, response.status)
+                        if response.status == 304 and keep_body:
+                            return response.status, self._read_stored(output_path)
+                        return response.status, None
+                    logger.debug(f"{url}: {response.status}, attempt {attempt + 1}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                logger.debug(f"{url}: {error!r}, attempt {attempt + 1}")
+            if attempt < self._retries:
+                await asyncio.sleep(self._backoff * 2 ** attempt)
+        return 'failed', None
+
+    def _discover(self, body, queue):
+        manifest = self._link_target.manifest
+        for page_id in self._link_extractor.extract(body):
+            if manifest.add_seen(page_id, self._file_name(page_id)):
+                self._stats['discovered'] += 1
+                queue.put_nowait((self._link_target, page_id))
+
+    async def _worker(self, session, queue, seed_slots):
+        while True:
+            target, page_id = await queue.get()
+            try:
+                extract_links = target is self._seed_target and self._link_extractor is not None
+                status, body = await self._download_single(session, target, page_id, keep_body=extract_links)
+                self._stats[status] += 1
+                if body:
+                    self._discover(body, queue)
+            except Exception:
+                logger.exception(f"Failed to download '{page_id}'.")
+                self._stats['failed'] += 1
+            finally:
+                queue.task_done()
+                if target is self._seed_target:
+                    seed_slots.release()
+
+    async def _crawl(self):
+        connector = aiohttp.TCPConnector(limit=self._concurrency, limit_per_host=self._per_host_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self._timeout)
+        # discovered pages are queued without limit, seeds only while a slot is free
+        queue = asyncio.Queue()
+        seed_slots = asyncio.Semaphore(2 * self._concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self._headers) as session:
+            workers = [asyncio.create_task(self._worker(session, queue, seed_slots))
+                       for _ in range(self._concurrency)]
+            if self._link_target is not None:
+                for page_id in self._link_target.manifest.unfetched():
+                    queue.put_nowait((self._link_target, page_id))
+            for page_id in self._idx_gen:
+                await seed_slots.acquire()
+                queue.put_nowait((self._seed_target, page_id))
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def start(self):
+        """Download all pages and return how many ended with each status."""
+
+        targets = [t for t in (self._seed_target, self._link_target) if t is not None]
+        self._stats = Counter()
+        try:
+            for target in targets:
+                target.open()
+            asyncio.run(self._crawl())
+        finally:
+            for target in targets:
+                target.close()
+        return dict(self._stats)
+
+
 if __name__ == "__main__":
     base = datetime.datetime(2014, 10, 20)
     date_list = [f"{(base - datetime.timedelta(days=x)):%Y/%m/%d}" for x in range(365 * 10)]
-    crwaler = Crawler(base_url='https://way2pay.ir/date/{page_id}',
-                      idx_gen=date_list,
-                      output_path="D:\\_temp\\crawler\\way2pay\\archive")
-    crwaler.start(workers=32)
-
-    # links = []
-    # with open("D:\\_temp\\crawler\\way2pay\\urls.txt", 'r', encoding='utf-8') as f:
-    #     links = [link.strip()[:-1].split('/')[-1] for link in f.readlines()]
-    #
-    # crwaler = Crawler(base_url='https://way2pay.ir/{page_id}/',
-    #                   idx_gen=links,
-    #                   output_path="D:\\_temp\\crawler\\way2pay\\posts")
-    # crwaler.start(workers=32)
+    post_links = LinkExtractor(pattern="https://way2pay.ir/([0-9]+)/",
+                               base_url='https://way2pay.ir/{page_id}/',
+                               output_path="D:\\_temp\\crawler\\way2pay\\posts")
+    crwaler = AsyncCrawler(base_url='https://way2pay.ir/date/{page_id}',
+                           idx_gen=date_list,
+                           output_path="D:\\_temp\\crawler\\way2pay\\archive",
+                           link_extractor=post_links)
+    print(crwaler.start())
@@ -0,0 +1,115 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+# statuses of responses whose content is stored in the output directory
+CONTENT_STATUSES = (200, 304)
+
+
+class CrawlManifest:
+    """Persistent record of the pages fetched by a crawler, stored in SQLite.
+
+    Pages are keyed by the name of their file in the output directory. For
+    every page the manifest keeps the url, the status of the last response,
+    the fetch time, a hash of the content and the `ETag`/`Last-Modified`
+    validators used for conditional requests. It also holds the set of page
+    ids discovered through links, whether they were fetched yet or not.
+    """
+
+    def __init__(self, manifest_path: Text, commit_every: int = 100) -> None:
+        self._connection = sqlite3.connect(manifest_path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "file_name TEXT PRIMARY KEY, url TEXT, status INTEGER, fetched_at REAL, "
+            "content_hash TEXT, etag TEXT, last_modified TEXT)"
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS seen (page_id TEXT PRIMARY KEY, file_name TEXT)")
+        self._commit_every = commit_every
+        self._pending = 0
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def get(self, file_name: Text) -> Optional[Dict[Text, Any]]:
+        row = self._connection.execute("SELECT * FROM pages WHERE file_name = ?", (file_name,)).fetchone()
+        return dict(row) if row else None
+
+    def has_content(self, file_name: Text) -> bool:
+        record = self.get(file_name)
+        return record is not None and record["status"] in CONTENT_STATUSES
+
+    def record(
+            self,
+            file_name: Text,
+            url: Optional[Text],
+            status: int,
+            content_hash: Optional[Text] = None,
+            etag: Optional[Text] = None,
+            last_modified: Optional[Text] = None,
+    ) -> None:
+        """Insert or update a page, validators of a not modified page are kept."""
+
+        self._connection.execute(
+            "INSERT INTO pages (file_name, url, status, fetched_at, content_hash, etag, last_modified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(file_name) DO UPDATE SET "
+            "url = excluded.url, status = excluded.status, fetched_at = excluded.fetched_at, "
+            "content_hash = COALESCE(excluded.content_hash, content_hash), "
+            "etag = COALESCE(excluded.etag, etag), "
+            "last_modified = COALESCE(excluded.last_modified, last_modified)",
+            (file_name, url, status, time.time(), content_hash, etag, last_modified),
+        )
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.commit()
+
+    def add_seen(self, page_id: Text, file_name: Text) -> bool:
+        """Add a discovered page to the seen-set.
+
+        Returns:
+            `True` if the page was not seen before.
+        """
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO seen (page_id, file_name) VALUES (?, ?)", (page_id, file_name)
+        )
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.commit()
+        return cursor.rowcount == 1
+
+    def unfetched(self) -> List[Text]:
+        """Ids of seen pages which were never fetched, e.g. because a crawl was interrupted."""
+
+        rows = self._connection.execute(
+            "SELECT seen.page_id FROM seen LEFT JOIN pages ON pages.file_name = seen.file_name "
+            "WHERE pages.file_name IS NULL"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def import_directory(self, output_path: Text) -> int:
+        """Register the files of a directory crawled before the manifest existed.
+
+        Returns:
+            The number of imported files.
+        """
+        count = 0
+        for file_name in os.listdir(output_path):
+            if file_name.endswith('.part') or self.get(file_name) is not None:
+                continue
+            self.record(file_name, None, 200)
+            count += 1
+        self.commit()
+        logger.info(f"Imported {count} existing pages from '{output_path}' into the crawl manifest.")
+        return count
+
+    def commit(self) -> None:
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._connection.close()
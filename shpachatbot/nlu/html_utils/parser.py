@@ -1,9 +1,16 @@
 import os
+import re
 from abc import abstractmethod
 from typing import Optional, List, Dict
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 
-from shpachatbot.exceptions import SHPAException
+try:
+    from lxml.cssselect import CSSSelector
+except ImportError:  # cssselect is not installed, parsers fall back to BeautifulSoup
+    CSSSelector = None
+
+from shpachatbot.exceptions import InvalidConfigException, SHPAException
+from shpachatbot.io import DEFAULT_ENCODING
 from shpachatbot.nlu.models import Message
 
 
@@ -44,9 +51,10 @@ def get_file_content(html_path: str):
 
 
 class HtmlField:
-    def __init__(self, *, name, selector, **attrs):
+    def __init__(self, *, name, selector, compiled_selector=None, **attrs):
         self._name = name
         self._selector = selector
+        self._compiled_selector = compiled_selector
         self._attrs = attrs
 
     @property
@@ -57,6 +65,10 @@ class HtmlField:
     def selector(self):
         return self._selector
 
+    @property
+    def compiled_selector(self):
+        return self._compiled_selector
+
     def __contains__(self, attr_key):
         if attr_key in self._attrs:
             return True
@@ -68,13 +80,131 @@ class HtmlField:
         return None
 
 
+class _RegionMatcher:
+    """Matches elements against a simple `tag`, `tag.class` or `tag#id` selector."""
+
+    _pattern = re.compile(r'^([a-zA-Z][\w-]*)?((?:[.#][\w-]+)*)$')
+
+    def __init__(self, css_selector: str):
+        match = self._pattern.match(css_selector.strip())
+        if not match:
+            raise InvalidConfigException(
+                f"Region selector '{css_selector}' must have the form 'tag', 'tag.class' or 'tag#id'")
+        self._tag = match.group(1).lower() if match.group(1) else None
+        qualifiers = re.findall(r'([.#])([\w-]+)', match.group(2))
+        self._classes = {name for kind, name in qualifiers if kind == '.'}
+        self._ids = {name for kind, name in qualifiers if kind == '#'}
+
+    def __call__(self, element) -> bool:
+        if self._tag and element.tag != self._tag:
+            return False
+        if self._ids and element.get('id') not in self._ids:
+            return False
+        return self._classes.issubset((element.get('class') or '').split())
+
+
 class HtmlParser:
+    """Extracts fields from an html file with css selectors.
+
+    By default the document is parsed into an lxml tree and every field is
+    matched with an XPath expression compiled from its css selector. The
+    compiled expressions are cached per parser class, so each selector is
+    translated once per process. BeautifulSoup is used when the `backend`
+    class attribute is "bs4", when cssselect is not installed or when lxml can
+    not parse the file.
+
+    Parsers can declare in `regions` the containers which hold all of their
+    fields. The file is then parsed incrementally and only the subtrees of
+    those containers are kept, everything else is freed while parsing. The
+    whole document is parsed when none of the regions is found.
+    """
+
+    backend = "lxml"
+    regions = ()
+    # increase when a change of the parser changes its output,
+    # it is part of the preprocessing fingerprint
+    version = 2
+
     def __init__(self, html_path: str):
+        if not os.path.exists(html_path):
+            raise HtmlFileNotFoundException(filename=get_filename_from_abspath(html_path))
+
         self.html_file_name = os.path.basename(html_path)
-        self._html_content = get_file_content(html_path)
-        self._soup = BeautifulSoup(self._html_content, "lxml")
+        self._roots = None
+        self._soup = None
+        if self.backend == "lxml" and CSSSelector is not None:
+            # an invalid region selector is a bug of the parser, it must not be taken for an unparsable file
+            matchers = self._region_matchers()
+            try:
+                self._roots = self._parse_regions(html_path, matchers) or [self._parse_document(html_path)]
+            except (etree.ParserError, etree.XMLSyntaxError, ValueError):
+                self._roots = None
+            if self._roots is not None:
+                # an empty or comment-only file has no root element, none of its fields is found
+                self._roots = [root for root in self._roots if root is not None]
+                for root in self._roots:
+                    # like the text of BeautifulSoup, field values never contain scripts and styles
+                    etree.strip_elements(root, 'script', 'style', with_tail=False)
+        if self._roots is None:
+            # BeautifulSoup is only needed for the fallback, it is not imported with the module
+            from bs4 import BeautifulSoup
+
+            self._soup = BeautifulSoup(get_file_content(html_path), "lxml")
         self._fields = {}
 
+    @classmethod
+    def _region_matchers(cls) -> List[_RegionMatcher]:
+        """The matchers of the `regions`, created once per parser class."""
+
+        matchers = cls.__dict__.get('_compiled_regions')
+        if matchers is None:
+            matchers = [_RegionMatcher(region) for region in cls.regions]
+            cls._compiled_regions = matchers
+        return matchers
+
+    def _parse_regions(self, html_path: str, matchers: List[_RegionMatcher]) -> List:
+        if not matchers:
+            return []
+
+        regions = []
+        depth = 0
+        for event, element in etree.iterparse(html_path, events=('start', 'end'), html=True,
+                                              remove_comments=True, encoding=DEFAULT_ENCODING):
+            if event == 'start':
+                if depth or any(matcher(element) for matcher in matchers):
+                    depth += 1
+            elif depth:
+                depth -= 1
+                if depth == 0:
+                    # detach the region, so it is kept when its ancestors are cleared
+                    if element.getparent() is not None:
+                        element.getparent().remove(element)
+                    regions.append(element)
+            else:
+                element.clear()
+        return regions
+
+    @staticmethod
+    def _parse_document(html_path: str):
+        parser = lxml_html.HTMLParser(encoding=DEFAULT_ENCODING, remove_comments=True)
+        return lxml_html.parse(html_path, parser=parser).getroot()
+
+    def release(self) -> None:
+        """Free the parsed document once all fields are extracted."""
+
+        self._roots = None
+        self._soup = None
+
+    @classmethod
+    def _compile_selector(cls, css_selector: str):
+        compiled_selectors = cls.__dict__.get('_compiled_selectors')
+        if compiled_selectors is None:
+            compiled_selectors = {}
+            cls._compiled_selectors = compiled_selectors
+        if css_selector not in compiled_selectors:
+            compiled_selectors[css_selector] = CSSSelector(css_selector, translator='html')
+        return compiled_selectors[css_selector]
+
     def __getitem__(self, field_name):
         try:
             return self._fields[field_name]
@@ -86,8 +216,10 @@ class HtmlParser:
             yield field
 
     def add_field(self, *, field_name: str, css_selector: str, is_multi: bool = False, value_from=None):
+        compiled_selector = self._compile_selector(css_selector) if self._roots is not None else None
         self._fields[field_name] = HtmlField(name=field_name,
                                              selector=css_selector,
+                                             compiled_selector=compiled_selector,
                                              is_multi=is_multi,
                                              value_from=value_from)
 
@@ -98,6 +230,25 @@ class HtmlParser:
         return result
 
     def _parse_field(self, field_name):
+        if self._roots is None:
+            return self._parse_field_bs4(field_name)
+
+        field = self[field_name]
+        selected = [e for root in self._roots for e in field.compiled_selector(root)]
+        if not field['is_multi']:
+            selected = selected[:1]
+
+        if field['value_from']:
+            selected = [e.get(field['value_from']) for e in selected if e.get(field['value_from']) is not None]
+        else:
+            selected = [''.join(e.itertext()) for e in selected]
+
+        if len(selected) == 1:
+            return selected[0]
+        else:
+            return selected
+
+    def _parse_field_bs4(self, field_name):
         field = self[field_name]
         selected = []
         if 'is_multi' in field and field['is_multi']:
@@ -106,9 +257,9 @@ class HtmlParser:
             selected.append(self._soup.select_one(self[field_name].selector))
 
         if 'value_from' in field and field['value_from']:
-            selected = [s[field['value_from']] for s in selected if s.has_attr(field['value_from'])]
+            selected = [s[field['value_from']] for s in selected if s is not None and s.has_attr(field['value_from'])]
         else:
-            selected = [s.text for s in selected]
+            selected = [s.text for s in selected if s is not None]
 
         if len(selected) == 1:
             return selected[0]
@@ -117,6 +268,7 @@ class HtmlParser:
 
     def parse_to_messages(self) -> List[Message]:
         result = self.parse()
+        self.release()
         return self.to_message(result)
 
     @abstractmethod
@@ -136,6 +288,8 @@ class HmashahriParser(HtmlParser):
 
 
 class Way2PayParser(HtmlParser):
+    regions = ('article',)
+
     def __init__(self, html_path: str):
         super(Way2PayParser, self).__init__(html_path)
         super().add_field(field_name='post_badges', css_selector='div.post-header-title span.term-badge', is_multi=True)
@@ -145,6 +299,9 @@ class Way2PayParser(HtmlParser):
         super().add_field(field_name='post_date', css_selector='time.post-published', value_from='datetime')
 
     def to_message(self, doc: Dict) -> List[Message]:
+        if not doc['post_content']:
+            # e.g. an empty page
+            return []
         message = Message(text=doc['post_content'])
         message['post_date'] = doc['post_date']
         message['post_title'] = doc['post_title']
@@ -0,0 +1,83 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Text
+
+MANIFEST_FILE_NAME = "preprocess.manifest.sqlite"
+
+
+class ProcessingManifest:
+    """Persistent record of the html files processed into an output directory.
+
+    For every input file the manifest keeps its size, modification time and
+    content hash together with the fingerprint of the pipeline which
+    processed it and the ids of the messages written for it. A file needs
+    processing only if it is new, if it changed or if the pipeline changed.
+    """
+
+    def __init__(self, manifest_path: Text, commit_every: int = 100) -> None:
+        self._connection = sqlite3.connect(manifest_path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_name TEXT PRIMARY KEY, size INTEGER, mtime REAL, content_hash TEXT, "
+            "fingerprint TEXT, processed_at REAL, message_ids TEXT)"
+        )
+        self._commit_every = commit_every
+        self._pending = 0
+
+    @classmethod
+    def for_output(cls, out_path: Text) -> "ProcessingManifest":
+        return cls(os.path.join(out_path, MANIFEST_FILE_NAME))
+
+    def get(self, file_name: Text) -> Optional[Dict[Text, Any]]:
+        row = self._connection.execute("SELECT * FROM files WHERE file_name = ?", (file_name,)).fetchone()
+        return dict(row) if row else None
+
+    def message_ids(self, file_name: Text) -> List[Text]:
+        """The ids of the messages written for a file the last time it was processed."""
+
+        row = self._connection.execute("SELECT message_ids FROM files WHERE file_name = ?", (file_name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else []
+
+    def file_names(self) -> List[Text]:
+        return [row[0] for row in self._connection.execute("SELECT file_name FROM files")]
+
+    def record(
+            self,
+            file_name: Text,
+            size: int,
+            mtime: float,
+            content_hash: Text,
+            fingerprint: Text,
+            message_ids: Optional[List[Text]] = None,
+    ) -> None:
+        """Insert or update a file, without `message_ids` the recorded ids are kept."""
+
+        self._connection.execute(
+            "INSERT INTO files (file_name, size, mtime, content_hash, fingerprint, processed_at, message_ids) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(file_name) DO UPDATE SET "
+            "size = excluded.size, mtime = excluded.mtime, content_hash = excluded.content_hash, "
+            "fingerprint = excluded.fingerprint, processed_at = excluded.processed_at, "
+            "message_ids = COALESCE(excluded.message_ids, message_ids)",
+            (file_name, size, mtime, content_hash, fingerprint, time.time(),
+             json.dumps(message_ids, ensure_ascii=False) if message_ids is not None else None),
+        )
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.commit()
+
+    def remove(self, file_name: Text) -> None:
+        self._connection.execute("DELETE FROM files WHERE file_name = ?", (file_name,))
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.commit()
+
+    def commit(self) -> None:
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._connection.close()
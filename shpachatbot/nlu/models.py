@@ -1,43 +1,98 @@
 import json
-from typing import Text, Optional, Dict, Any, List
+import sys
+from typing import Text, Optional, Dict, Any, List, Union
 
 
 def to_json(dic: Dict) -> Text:
     return json.dumps(dic, indent=4, ensure_ascii=False)
 
 
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
 class Token:
+    """A token of a sentence.
+
+    Tokens created by a `Sentence` are lightweight views on the columns of
+    the sentence, a standalone token keeps its own properties until it is
+    added to a sentence.
+    """
+
+    __slots__ = ("_sentence", "_index", "_text", "_properties")
+
     def __init__(
             self,
             text: Text,
             properties: Optional[Dict[Text, Any]] = None,
     ) -> None:
-        self.text = text
+        self._sentence = None
+        self._index = None
+        self._text = text
         self._properties = properties if properties else {}
-        self._exclude_properties = []
+
+    @classmethod
+    def _view(cls, sentence: "Sentence", index: int) -> "Token":
+        token = cls.__new__(cls)
+        token._sentence = sentence
+        token._index = index
+        token._text = None
+        token._properties = None
+        return token
+
+    @property
+    def text(self) -> Text:
+        if self._sentence is None:
+            return self._text
+        return self._sentence._texts[self._index]
+
+    @text.setter
+    def text(self, value: Text) -> None:
+        if self._sentence is None:
+            self._text = value
+        else:
+            self._sentence._texts[self._index] = _intern(value)
+
+    @property
+    def properties(self) -> Dict[Text, Any]:
+        if self._sentence is None:
+            return self._properties
+        return {key: column[self._index] for key, column in self._sentence._attributes.items()
+                if column[self._index] is not None}
 
     @property
     def dict(self) -> Dict:
         json_dict = {"text": self.text}
-        for key, value in self._properties.items():
+        for key, value in self.properties.items():
             json_dict[key] = value
         return json_dict
 
     def __setitem__(self, key: Text, value: Any) -> None:
-        self._properties[key] = value
+        if self._sentence is None:
+            self._properties[key] = value
+        else:
+            self._sentence._set_attribute(key, self._index, value)
 
     def __getitem__(self, key: Text) -> Any:
-        return self._properties.get(key)
+        if self._sentence is None:
+            return self._properties.get(key)
+        column = self._sentence._attributes.get(key)
+        return column[self._index] if column else None
 
     def __repr__(self):
-        props = []
-        if self._properties:
-            props = [f"{key}:'{value}'" for key, value in self._properties.items()
-                     if key not in self._exclude_properties]
+        props = [f"{key}:'{value}'" for key, value in self.properties.items()]
         return f"<Token text: '{self.text}'{' ,'.join(props)}>"
 
 
 class Sentence:
+    """A sentence which stores its tokens column-wise.
+
+    Token texts and every token attribute (stem, lemma, ...) are kept in
+    parallel lists of interned strings, `tokens` returns `Token` views on them.
+    """
+
+    __slots__ = ("text", "_texts", "_attributes", "_properties")
+
     def __init__(
             self,
             text: Text,
@@ -45,8 +100,11 @@ class Sentence:
             properties: Optional[Dict[Text, Any]] = None
     ) -> None:
         self.text = text
-        self._tokens = tokens if tokens else []
+        self._texts = []
+        self._attributes = {}
         self._properties = properties if properties else {}
+        for token in tokens or []:
+            self.add_token(token)
 
     def __setitem__(self, key: Text, value: Any) -> None:
         self._properties[key] = value
@@ -54,19 +112,85 @@ class Sentence:
     def __getitem__(self, key: Text) -> Any:
         return self._properties.get(key)
 
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def _set_attribute(self, key: Text, index: int, value: Any) -> None:
+        column = self._attributes.get(key)
+        if column is None:
+            column = [None] * len(self._texts)
+            self._attributes[key] = column
+        column[index] = _intern(value)
+
     def add_token(self, token: Token) -> None:
-        self._tokens.append(token)
+        index = len(self._texts)
+        self._texts.append(_intern(token.text))
+        for column in self._attributes.values():
+            column.append(None)
+        for key, value in token.properties.items():
+            self._set_attribute(key, index, value)
+
+    def add_tokens(self, texts: List[Text], attributes: Optional[Dict[Text, List[Any]]] = None) -> None:
+        """Append tokens given as a list of texts and a list of values per attribute."""
+
+        count = len(self._texts)
+        self._texts.extend(_intern(t) for t in texts)
+        attributes = attributes if attributes else {}
+        for key, column in self._attributes.items():
+            if key not in attributes:
+                column.extend([None] * len(texts))
+        for key, values in attributes.items():
+            column = self._attributes.setdefault(key, [None] * count)
+            column.extend(_intern(v) for v in values)
 
     @property
-    def tokens(self):
-        return self._tokens
+    def tokens(self) -> List[Token]:
+        return [Token._view(self, idx) for idx in range(len(self._texts))]
+
+    @property
+    def token_texts(self) -> List[Text]:
+        return self._texts
+
+    def token_attribute(self, key: Text) -> List[Any]:
+        """The values of a token attribute, `None` for tokens without it."""
+
+        if key == "text":
+            return self._texts
+        column = self._attributes.get(key)
+        return column if column is not None else [None] * len(self._texts)
+
+    @classmethod
+    def from_dict(cls, data: Dict[Text, Any]) -> "Sentence":
+        """Rebuild a sentence from its `dict` form."""
+
+        tokens = data.get("tokens", [])
+        keys = {}
+        for token in tokens:
+            keys.update(dict.fromkeys(token))
+        keys.pop("text", None)
+        sentence = cls(data["text"])
+        sentence.add_tokens([t["text"] for t in tokens], {key: [t.get(key) for t in tokens] for key in keys})
+        for key, value in data.items():
+            if key not in ("text", "tokens_count", "tokens"):
+                sentence[key] = value
+        return sentence
 
     @property
     def dict(self) -> Dict:
+        columns = list(self._attributes.items())
+        tokens = []
+        for idx, text in enumerate(self._texts):
+            token_dict = {"text": text}
+            for key, column in columns:
+                value = column[idx]
+                if value is not None:
+                    token_dict[key] = value
+            tokens.append(token_dict)
+
         json_dict = {
             'text': self.text,
-            'tokens_count': len(self._tokens),
-            'tokens': [t.dict for t in self._tokens]
+            'tokens_count': len(self._texts),
+            'tokens': tokens
         }
         for key, value in self._properties.items():
             json_dict[key] = value
@@ -74,6 +198,9 @@ class Sentence:
 
 
 class Message:
+    # `features` holds the numeric features of a featurizer, they are not serialized
+    __slots__ = ("text", "_sentences", "_properties", "features", "_raw_sentences")
+
     def __init__(
             self,
             text: Text,
@@ -83,9 +210,33 @@ class Message:
         self.text = text
         self._sentences = sentences if sentences else []
         self._properties = properties if properties else {}
+        self.features = None
+        # sentences of a loaded message in their `dict` form, they are built on first access
+        self._raw_sentences = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[Text, Any]) -> "Message":
+        """Rebuild a message from its `dict` form.
+
+        The sentences are only rebuilt when they are accessed, a message which
+        is serialized again without touching its sentences reuses their
+        loaded form.
+        """
+        message = cls(data["text"])
+        for key, value in data.items():
+            if key not in ("text", "sentences_count", "sentences"):
+                message[key] = value
+        message._raw_sentences = data.get("sentences")
+        return message
+
+    @classmethod
+    def from_json(cls, data: Union[Text, bytes], backend: Optional[Text] = None) -> "Message":
+        from shpachatbot.nlu.serialization import get_json_backend
+
+        return cls.from_dict(get_json_backend(backend).loads(data))
 
     def add_sentence(self, sentence: Sentence) -> None:
-        self._sentences.append(sentence)
+        self.sentences.append(sentence)
 
     def __setitem__(self, key: Text, value: Any) -> None:
         self._properties[key] = value
@@ -98,17 +249,27 @@ class Message:
             yield key, value
 
     @property
-    def sentences(self):
+    def sentences(self) -> List[Sentence]:
+        if self._raw_sentences is not None:
+            self._sentences = [Sentence.from_dict(s) for s in self._raw_sentences]
+            self._raw_sentences = None
         return self._sentences
 
     @property
-    def json(self) -> Text:
+    def dict(self) -> Dict:
+        raw_sentences = self._raw_sentences
         json_dict = {
             'text': self.text,
-            'sentences_count': len(self._sentences),
+            'sentences_count': len(raw_sentences) if raw_sentences is not None else len(self._sentences),
         }
         for key, value in self._properties.items():
             json_dict[key] = value
-        if self._sentences:
+        if raw_sentences:
+            json_dict['sentences'] = raw_sentences
+        elif self._sentences:
             json_dict['sentences'] = [s.dict for s in self._sentences]
-        return to_json(json_dict)
+        return json_dict
+
+    @property
+    def json(self) -> Text:
+        return to_json(self.dict)
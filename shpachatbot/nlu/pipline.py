@@ -1,63 +1,357 @@
+import argparse
+import contextlib
+import logging
 import os
-from typing import Text, TypeVar, Type
+import time
+import tracemalloc
+from multiprocessing.util import Finalize
+from typing import (Any, Dict, Iterator, List, Optional, Set, Text, Tuple, TypeVar, Type, Union, ContextManager,
+                    TYPE_CHECKING)
 
-from shpachatbot.nlu.html_utils.parser import Way2PayParser, HtmlParser
-from shpachatbot.nlu.tokenizers.hazm import HazmTokenizer, HazmNormalizer
-from shpachatbot.nlu.train.ngrams import Ngrams
-from shpachatbot.worker import worker_start
+from shpachatbot import __version__
+from shpachatbot.config import NLUModelConfig, load
+from shpachatbot.exceptions import InvalidConfigException
+from shpachatbot.metrics import Metrics
+from shpachatbot.nlu import registry
+from shpachatbot.nlu.components import Component, validate_required_components
+from shpachatbot.nlu.manifest import ProcessingManifest
+from shpachatbot.nlu.models import Message
+from shpachatbot.nlu.writers import ShardWriter, shard_files
+from shpachatbot.utils import chunks, get_dictionary_fingerprint, get_file_hash
+from shpachatbot.worker import worker_imap
 
-config_path = "D:\\ProjectServer\\SHPA.NLP\\shpachatbot\\config\\default_config.yml"
+logger = logging.getLogger(__name__)
 
-TParser = TypeVar("TParser", bound=HtmlParser)
+if TYPE_CHECKING:
+    # the parsers import lxml, worker processes import them when they receive the parser class
+    from shpachatbot.nlu.html_utils.parser import HtmlParser
+
+TParser = TypeVar("TParser", bound="HtmlParser")
+
+
+def _count_tokens(messages: List[Message]) -> int:
+    return sum(len(sentence) for message in messages for sentence in message.sentences)
+
+
+class Pipeline:
+    """Runs messages through the components of an NLU model configuration.
+
+    With `metrics` the time, messages and tokens of every component are
+    recorded as a stage named after the component.
+    """
+
+    def __init__(self, components: List[Component], metrics: Optional[Metrics] = None) -> None:
+        validate_required_components(components)
+        self._components = components
+        self.metrics = metrics
+
+    @classmethod
+    def create(cls, model_config: NLUModelConfig, metrics: Optional[Metrics] = None) -> "Pipeline":
+        """Build the components of `model_config.pipeline` through the registry.
+
+        Raises:
+            InvalidConfigException: If the pipeline is empty or a required
+                component is missing.
+        """
+        if not model_config.pipeline:
+            raise InvalidConfigException(
+                "Can not create a pipeline without components. Please add the "
+                "components to the 'pipeline' section of the configuration."
+            )
+
+        components = [registry.create_component_by_config(component_config)
+                      for component_config in model_config.pipeline]
+        return cls(components, metrics)
+
+    @property
+    def components(self) -> List[Component]:
+        return self._components
+
+    def process(self, message: Message, **kwargs: Any) -> Optional[Message]:
+        """Process a single message, `None` if a component filtered it out."""
+
+        messages = self.process_batch([message], **kwargs)
+        return messages[0] if messages else None
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> List[Message]:
+        """Process a batch of messages.
+
+        Returns:
+            The processed messages, without those which a filtering
+            component, e.g. `DuplicateFilter`, dropped.
+        """
+        if self.metrics is None:
+            for component in self._components:
+                kept = component.process_batch(messages, **kwargs)
+                if kept is not None:
+                    messages = kept
+            return messages
+
+        for component in self._components:
+            with self.metrics.measure(component.name) as counts:
+                counts["messages"] = len(messages)
+                kept = component.process_batch(messages, **kwargs)
+                if kept is not None:
+                    messages = kept
+                counts["tokens"] = _count_tokens(messages)
+        return messages
+
+    def persist(self) -> None:
+        for component in self._components:
+            component.persist()
+
+
+# state of a preprocessing worker process, built once by `_init_worker`
+_worker_state: Dict[Text, Any] = {}
+
+
+def _init_worker(
+        model_config: NLUModelConfig,
+        parser_cls: Type[TParser],
+        input_path: Text,
+        out_path: Text,
+        writer_config: Dict[Text, Any],
+        instrument: bool = False,
+        track_memory: bool = False,
+) -> None:
+    metrics = Metrics(track_memory) if instrument else None
+    if metrics is not None and track_memory:
+        tracemalloc.start()
+    _worker_state["metrics"] = metrics
+    # loading the models of the components is part of the cost of every worker
+    with _measure("setup"):
+        pipeline = Pipeline.create(model_config, metrics)
+    writer = ShardWriter(out_path, **writer_config)
+    _worker_state["pipeline"] = pipeline
+    _worker_state["writer"] = writer
+    _worker_state["parser_cls"] = parser_cls
+    _worker_state["input_path"] = input_path
+    # worker processes exit through multiprocessing, which runs finalizers but not atexit hooks
+    Finalize(pipeline, pipeline.persist, exitpriority=10)
+    Finalize(writer, writer.close, exitpriority=10)
+
+
+def _measure(stage: Text) -> ContextManager[Dict[Text, int]]:
+    metrics = _worker_state["metrics"]
+    return metrics.measure(stage) if metrics is not None else contextlib.nullcontext({})
+
+
+def _process_files(
+        tasks: List[Tuple[Text, Optional[Text]]]
+) -> Tuple[int, List[Tuple[Text, int, float, Text, Optional[List[Text]]]], Optional[Dict[Text, Dict[Text, Any]]]]:
+    """Parse, process and write the messages of a chunk of html files.
+
+    Args:
+        tasks: names of the files with the content hash they had when they
+            were processed the last time, if any. Files whose content did not
+            change are not processed again.
+
+    Returns:
+        The number of written messages, the name, size, modification time,
+        content hash and the ids of the written messages of every file of
+        the chunk, `None` for files which were not processed again, and,
+        when the worker is instrumented, the metrics of the chunk.
+    """
+    parser_cls = _worker_state["parser_cls"]
+    input_path = _worker_state["input_path"]
+
+    messages = []
+    files = []
+    for file_name, previous_hash in tasks:
+        file_path = os.path.join(input_path, file_name)
+        with _measure("read"):
+            stat = os.stat(file_path)
+            content_hash = get_file_hash(file_path)
+        if content_hash == previous_hash:
+            files.append((file_name, stat.st_size, stat.st_mtime, content_hash, None))
+            continue
+        with _measure("parse") as counts:
+            file_messages = parser_cls(file_path).parse_to_messages()
+            counts["messages"] = len(file_messages)
+        files.append((file_name, stat.st_size, stat.st_mtime, content_hash, file_messages))
+        messages.extend(file_messages)
+
+    messages = _worker_state["pipeline"].process_batch(messages)
+    # messages dropped by a filtering component, e.g. `DuplicateFilter`, are not written for their file
+    written = {id(message) for message in messages}
+    records = [(file_name, size, mtime, content_hash,
+                [m['id'] for m in file_messages if id(m) in written] if file_messages is not None else None)
+               for file_name, size, mtime, content_hash, file_messages in files]
+    writer = _worker_state["writer"]
+    with _measure("write") as counts:
+        writer.write_all(messages)
+        writer.flush()
+        counts["messages"] = len(messages)
+
+    metrics = _worker_state["metrics"]
+    return len(messages), records, metrics.snapshot(reset=True) if metrics is not None else None
+
+
+def pipeline_fingerprint(model_config: NLUModelConfig, parser_cls: Type[TParser]) -> Text:
+    """Fingerprint of the configuration and versions which determine the preprocessing output."""
+
+    return get_dictionary_fingerprint({
+        "version": __version__,
+        "parser": [parser_cls.__name__, parser_cls.version],
+        "pipeline": model_config.pipeline,
+        "components": [registry.get_component_class(c["name"]).version for c in model_config.pipeline],
+    })
 
 
 class PreProcessor:
-    def __init__(self, html_file_full_path: Text, out_path: Text) -> None:
+    def __init__(
+            self,
+            html_file_full_path: Text,
+            out_path: Text,
+            config: Optional[Union[Text, Dict[Text, Any]]] = None,
+            shard_format: Text = "jsonl",
+            max_shard_bytes: int = 256 * 1024 * 1024,
+            max_shard_messages: Optional[int] = None,
+    ) -> None:
         if not os.path.exists(html_file_full_path):
             raise FileNotFoundError
 
         self._out_path = out_path
         self._input_path = html_file_full_path
-        self._normalizer = HazmNormalizer.create()
-        self._tokenizer = HazmTokenizer.create(component_config={"stemmer": True})
-        self._ngram = Ngrams()
-        self._parser_cls = None
-
-    def _single_process(self, file_name: Text):
-        file_path = os.path.join(self._input_path, file_name)
-        if os.path.isdir(file_path):
-            return
-        parser = self._parser_cls(file_path)
-        messages = parser.parse_to_messages()
-        for m_item in messages:
-            self._normalizer.process(m_item, exclude_items=['id', 'post_date'])
-
-            self._tokenizer.process(m_item)
-            # self._ngram.process(m_item, n=2)
-            # self._ngram.process(m_item, n=3)
-            # self._ngram.process(m_item, n=4)
-            # self._ngram.process(m_item, n=5)
-            # self._ngram.process(m_item, n=6)
-
-            path = os.path.join(self._out_path, f"{m_item['id'].strip().replace(' ', '_').replace('.', '_')}.json")
-            if os.path.exists(path):
-                os.remove(path)
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(m_item.json)
-
-    def process(self, parser_cls: Type[TParser]):
-        self._parser_cls = parser_cls
-        worker_start(worker_func=self._single_process,
-                     worker_itr=os.listdir(self._input_path),
-                     workers=4,
-                     enable_tqdm=True)
+        self._model_config = load(config)
+        self.metrics = None
+        self._writer_config = {"shard_format": shard_format,
+                               "max_shard_bytes": max_shard_bytes,
+                               "max_shard_messages": max_shard_messages}
+
+    def _files_to_process(
+            self, manifest: ProcessingManifest, fingerprint: Text, incremental: bool, seen: Set[Text]
+    ) -> Iterator[Tuple[Text, Optional[Text]]]:
+        for entry in os.scandir(self._input_path):
+            # skip directories and pages which the crawler is still downloading
+            if not entry.is_file() or entry.name.endswith('.part'):
+                continue
+            seen.add(entry.name)
+
+            record = manifest.get(entry.name) if incremental else None
+            if record is None or record['fingerprint'] != fingerprint:
+                yield entry.name, None
+                continue
+
+            stat = entry.stat()
+            if record['size'] != stat.st_size or record['mtime'] != stat.st_mtime:
+                yield entry.name, record['content_hash']
+
+    def process(
+            self,
+            parser_cls: Type[TParser],
+            workers: int = 4,
+            chunk_size: int = 32,
+            incremental: bool = False,
+            report_path: Optional[Text] = None,
+            track_memory: bool = False,
+    ) -> int:
+        """Process all html files of the input path with a pool of workers.
+
+        Every worker builds the pipeline once, tasks only carry the names of
+        `chunk_size` files whose messages are processed as one batch. The
+        messages are written to the shards of a `ShardWriter` per worker.
+
+        Processed files are recorded in a `ProcessingManifest` in the output
+        path, together with the ids of their written messages. In
+        `incremental` mode only files which are new, whose content changed
+        or which were processed with another pipeline fingerprint are
+        processed, the messages a reprocessed or deleted file no longer
+        produces are deleted from the shards with tombstones. Otherwise the
+        shards of earlier runs are removed once all files are processed.
+
+        With `report_path` the workers record the time spent reading,
+        parsing, in every component and writing. The metrics of all workers
+        are combined in `self.metrics` and written as a json report.
+        `track_memory` adds the memory allocated by each stage, which slows
+        the workers down considerably.
+
+        Returns:
+            The number of written messages.
+        """
+        instrument = report_path is not None
+        self.metrics = Metrics(track_memory) if instrument else None
+        fingerprint = pipeline_fingerprint(self._model_config, parser_cls)
+        manifest = ProcessingManifest.for_output(self._out_path)
+        # tombstones of the messages which files no longer produce
+        deletions = ShardWriter(self._out_path, **self._writer_config)
+        stale_shards = [] if incremental else shard_files(self._out_path)
+        seen = set()
+        message_count = file_count = 0
+        start = time.perf_counter()
+        try:
+            tasks = chunks(self._files_to_process(manifest, fingerprint, incremental, seen), chunk_size)
+            results = worker_imap(worker_func=_process_files,
+                                  worker_itr=tasks,
+                                  workers=workers,
+                                  enable_tqdm=True,
+                                  initializer=_init_worker,
+                                  initargs=(self._model_config, parser_cls, self._input_path, self._out_path,
+                                            self._writer_config, instrument, track_memory),
+                                  ordered=False)
+            for count, records, metrics in results:
+                message_count += count
+                file_count += len(records)
+                if metrics:
+                    self.metrics.merge(metrics)
+                for file_name, size, mtime, content_hash, message_ids in records:
+                    if message_ids is not None and incremental:
+                        for message_id in set(manifest.message_ids(file_name)).difference(message_ids):
+                            deletions.delete(message_id)
+                    manifest.record(file_name, size, mtime, content_hash, fingerprint, message_ids)
+
+            for file_name in set(manifest.file_names()).difference(seen):
+                if incremental:
+                    for message_id in manifest.message_ids(file_name):
+                        deletions.delete(message_id)
+                manifest.remove(file_name)
+        finally:
+            deletions.close()
+            manifest.close()
+
+        for file_name in stale_shards:
+            os.remove(os.path.join(self._out_path, file_name))
+        if stale_shards:
+            logger.info(f"Removed {len(stale_shards)} shard and index files of earlier runs.")
+
+        if instrument:
+            wall_time = time.perf_counter() - start
+            self.metrics.report(report_path,
+                                parser=parser_cls.__name__,
+                                workers=workers,
+                                chunk_size=chunk_size,
+                                incremental=incremental,
+                                files=file_count,
+                                messages=message_count,
+                                wall_time=wall_time,
+                                messages_per_second=message_count / wall_time if wall_time else None)
+        return message_count
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Parse crawled html files and process them with the NLU pipeline.")
+    parser.add_argument("input_path", help="directory of the crawled html files")
+    parser.add_argument("out_path", help="directory of the message shards")
+    parser.add_argument("--parser", default="Way2PayParser", help="name of the html parser class")
+    parser.add_argument("--config", help="configuration file of the pipeline, the default configuration if omitted")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=32, help="number of files per task")
+    parser.add_argument("--shard-format", default="jsonl", choices=["jsonl", "msgpack"])
+    parser.add_argument("--incremental", action="store_true", help="only process new and changed files")
+    parser.add_argument("--report", help="write a json report of the time spent in every stage to this file")
+    return parser
 
 
 if __name__ == "__main__":
-    html_file_full_path = "D:/_temp/crawler/way2pay/posts"
-    # html_file_full_path = "D:/_temp/crawler/melli_fqq/post"
-    out_path = "D:/_temp/crawler/pre_process"
+    from shpachatbot.nlu.html_utils import parser as html_parsers
 
-    preprocessor = PreProcessor(html_file_full_path=html_file_full_path, out_path=out_path)
-    preprocessor.process(Way2PayParser)
-    # preprocessor.process(MelliFaqParser)
+    arguments = create_argument_parser().parse_args()
+    os.makedirs(arguments.out_path, exist_ok=True)
+    preprocessor = PreProcessor(arguments.input_path, arguments.out_path, config=arguments.config,
+                                shard_format=arguments.shard_format)
+    count = preprocessor.process(getattr(html_parsers, arguments.parser),
+                                 workers=arguments.workers,
+                                 chunk_size=arguments.chunk_size,
+                                 incremental=arguments.incremental,
+                                 report_path=arguments.report)
+    print(f"Wrote {count} messages to '{arguments.out_path}'.")
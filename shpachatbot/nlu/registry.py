@@ -1,10 +1,45 @@
+import importlib
 import logging
+from typing import Any, Dict, Text, Type
 
-from shpachatbot.nlu.tokenizers.hazm import HazmTokenizer
+from shpachatbot.exceptions import ComponentNotFoundException
+from shpachatbot.nlu.components import Component
 
 logger = logging.getLogger(__name__)
 
-component_classes = [
-    HazmTokenizer
-]
-registered_components = {c.name: c for c in component_classes}
+# components are imported when they are first used, so processes only pay
+# for the dependencies (hazm, numpy, scipy, ...) of their own pipeline
+registered_components = {
+    "HazmNormalizer": "shpachatbot.nlu.tokenizers.hazm",
+    "HazmTokenizer": "shpachatbot.nlu.tokenizers.hazm",
+    "DuplicateFilter": "shpachatbot.nlu.dedup",
+    "Ngrams": "shpachatbot.nlu.train.ngrams",
+    "Vocabulary": "shpachatbot.nlu.vocabulary",
+    "HashingFeaturizer": "shpachatbot.nlu.featurizers.hashing",
+}
+
+
+def get_component_class(component_name: Text) -> Type[Component]:
+    """Resolve a component name to a registered component class."""
+
+    if component_name not in registered_components:
+        raise ComponentNotFoundException(
+            f"Cannot find class '{component_name}' in the registry. Registered "
+            f"components are: {', '.join(registered_components)}."
+        )
+    module = importlib.import_module(registered_components[component_name])
+    return getattr(module, component_name)
+
+
+def create_component_by_config(component_config: Dict[Text, Any]) -> Component:
+    """Create a component based on its configuration in the pipeline.
+
+    Args:
+        component_config: The configuration of the component, it must contain
+            the `name` of the component.
+
+    Returns:
+        The created component.
+    """
+    component_class = get_component_class(component_config["name"])
+    return component_class.create(dict(component_config))
@@ -0,0 +1,178 @@
+import json
+import os
+from json.encoder import encode_basestring
+from typing import Any, Callable, IO, Iterable, Iterator, List, Optional, Text, Union
+
+from shpachatbot.exceptions import SHPAException
+from shpachatbot.io import DEFAULT_ENCODING
+from shpachatbot.nlu.models import Message, Sentence
+
+# backends in the order of preference, the first installed one is the default
+JSON_BACKENDS = ("orjson", "json")
+
+
+class UnknownJsonBackendException(SHPAException):
+    def __init__(self, backend: Text) -> None:
+        self.backend = backend
+
+    def __str__(self) -> Text:
+        return f"Unknown or not installed json backend '{self.backend}', use one of: {', '.join(JSON_BACKENDS)}"
+
+
+class JsonBackend:
+    """Compact json encoding to utf-8 bytes and decoding from bytes or text."""
+
+    def __init__(self, name: Text, dumps: Callable[[Any], bytes], loads: Callable[[Union[bytes, Text]], Any]) -> None:
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def dumps_text(self, obj: Any) -> Text:
+        return self.dumps(obj).decode(DEFAULT_ENCODING)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(DEFAULT_ENCODING)
+
+
+def _create_backend(name: Text) -> Optional[JsonBackend]:
+    if name == "json":
+        return JsonBackend("json", _json_dumps, json.loads)
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            return None
+        return JsonBackend("orjson", orjson.dumps, orjson.loads)
+    return None
+
+
+_backends = {}
+
+
+def get_json_backend(name: Optional[Text] = None) -> JsonBackend:
+    """Return a json backend by name, by default the fastest installed one.
+
+    Raises:
+        UnknownJsonBackendException: If the backend is unknown or not installed.
+    """
+    if name is None:
+        for candidate in JSON_BACKENDS:
+            try:
+                return get_json_backend(candidate)
+            except UnknownJsonBackendException:
+                continue
+    if name not in _backends:
+        backend = _create_backend(name)
+        if backend is None:
+            raise UnknownJsonBackendException(name)
+        _backends[name] = backend
+    return _backends[name]
+
+
+def _encode_value(value: Any, backend: JsonBackend) -> Text:
+    return encode_basestring(value) if type(value) is str else backend.dumps_text(value)
+
+
+def _encode_sentence(sentence: Sentence, backend: JsonBackend) -> Text:
+    texts = sentence.token_texts
+    columns = [(f',{encode_basestring(key)}:', column) for key, column in sentence._attributes.items()]
+    tokens = []
+    for idx, text in enumerate(texts):
+        parts = ['{"text":', encode_basestring(text)]
+        for prefix, column in columns:
+            value = column[idx]
+            if value is not None:
+                parts.append(prefix)
+                parts.append(_encode_value(value, backend))
+        parts.append('}')
+        tokens.append(''.join(parts))
+
+    parts = ['{"text":', encode_basestring(sentence.text), ',"tokens_count":', str(len(texts)),
+             ',"tokens":[', ','.join(tokens), ']']
+    for key, value in sentence._properties.items():
+        parts.append(f',{encode_basestring(key)}:{_encode_value(value, backend)}')
+    parts.append('}')
+    return ''.join(parts)
+
+
+def iter_encode_message(message: Message, backend: Optional[JsonBackend] = None) -> Iterator[Text]:
+    """Encode a message as compact json, piece by piece.
+
+    The output is the json of `Message.dict`, but the nested dictionaries of
+    the sentences and tokens are never built: the token columns of every
+    sentence are encoded directly.
+    """
+    backend = backend or get_json_backend()
+    raw_sentences = message._raw_sentences
+    sentences = message._sentences if raw_sentences is None else raw_sentences
+    yield f'{{"text":{encode_basestring(message.text)},"sentences_count":{len(sentences)}'
+    for key, value in message:
+        yield f',{encode_basestring(key)}:{_encode_value(value, backend)}'
+    if raw_sentences:
+        # sentences which were loaded but never accessed are written as they were read
+        yield f',"sentences":{backend.dumps_text(raw_sentences)}'
+    elif sentences:
+        yield ',"sentences":['
+        for idx, sentence in enumerate(sentences):
+            yield f',{_encode_sentence(sentence, backend)}' if idx else _encode_sentence(sentence, backend)
+        yield ']'
+    yield '}'
+
+
+def dumps_message(message: Message, backend: Optional[JsonBackend] = None) -> bytes:
+    """The compact json of a message as utf-8 bytes."""
+
+    backend = backend or get_json_backend()
+    if backend.name == "orjson":
+        # orjson encodes the nested dictionaries in native code, faster than the columns are encoded in Python
+        return backend.dumps(message.dict)
+    return ''.join(iter_encode_message(message, backend)).encode(DEFAULT_ENCODING)
+
+
+def write_message(message: Message, f: IO[Text], backend: Optional[JsonBackend] = None) -> None:
+    """Write the json of a message to a text file handle without building it in memory first."""
+
+    for chunk in iter_encode_message(message, backend):
+        f.write(chunk)
+
+
+def write_messages(messages: Iterable[Message], file_path: Text, backend: Optional[JsonBackend] = None) -> int:
+    """Write messages to a json lines file, one message per line.
+
+    Returns:
+        The number of written messages.
+    """
+    count = 0
+    with open(file_path, 'w', encoding=DEFAULT_ENCODING) as f:
+        for message in messages:
+            write_message(message, f, backend)
+            f.write('\n')
+            count += 1
+    return count
+
+
+def iter_messages(path: Text, backend: Optional[JsonBackend] = None) -> Iterator[Message]:
+    """Load the messages of a json lines file or of a shard directory one by one.
+
+    Only one message is held in memory at a time and its sentences are only
+    rebuilt when they are accessed, so stages which need the tokens, e.g.
+    n-gram counting or indexing, can reuse processed output without running
+    the tokenizer again.
+    """
+    if os.path.isdir(path):
+        from shpachatbot.nlu.writers import iter_records
+
+        for record in iter_records(path):
+            yield Message.from_dict(record)
+        return
+
+    backend = backend or get_json_backend()
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield Message.from_dict(backend.loads(line))
+
+
+def load_messages(path: Text, backend: Optional[JsonBackend] = None) -> List[Message]:
+    return list(iter_messages(path, backend))
@@ -1,64 +1,119 @@
 from typing import Dict, Text, Any, List
-from hazm import Normalizer, sent_tokenize, word_tokenize, Stemmer, Lemmatizer, POSTagger
 
+from shpachatbot.nlu.cache import LookupCache, load_caches, save_caches
 from shpachatbot.nlu.components import Component
-from shpachatbot.nlu.models import Message, Token, Sentence
+from shpachatbot.nlu.models import Message, Sentence
 from shpachatbot.constants import TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM, TOKEN_ATTRIBUTE_POS
 
 
 class HazmNormalizer(Component):
+    # only short values such as titles, tags and badges repeat often enough to be cached
+    defaults = {"exclude_items": [], "cache_size": 10000, "cache_max_length": 100, "cache_path": None}
+
     def __init__(self, component_config: Dict[Text, Any] = None) -> None:
         super().__init__(component_config)
+        # hazm loads nltk, so it is imported when a component is created rather than with this module
+        from hazm import Normalizer
+
         self._normalizer = Normalizer()
+        self._normalize_cache = LookupCache(self._normalizer.normalize, self.component_config.cache_size)
+        load_caches(self.component_config.cache_path, normalize=self._normalize_cache)
+
+    @classmethod
+    def required_packages(cls) -> List[Text]:
+        return ['hazm']
+
+    @property
+    def cache_stats(self) -> Dict[Text, Dict[Text, Any]]:
+        return {"normalize": self._normalize_cache.stats}
+
+    def persist(self) -> None:
+        if self.component_config.cache_path:
+            save_caches(self.component_config.cache_path, normalize=self._normalize_cache)
 
     def process(self, message: Message, **kwargs: Any) -> None:
-        message.text = self._normalizer.normalize(message.text)
-        exclude_items = {}
-        if 'exclude_items' in kwargs:
-            exclude_items = {x: x for x in kwargs['exclude_items']}
-        for key, value in message:
-            if key in exclude_items:
-                continue
-            if isinstance(value, str):
-                message[key] = self._normalizer.normalize(value)
-            elif isinstance(value, list):
-                for idx, item_value in enumerate(value):
-                    value[idx] = self._normalizer.normalize(item_value)
+        self.process_batch([message], **kwargs)
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> None:
+        normalize = self._normalizer.normalize
+        normalize_cached = self._normalize_cache
+        cache_max_length = self.component_config.cache_max_length
+        exclude_items = set(kwargs.get('exclude_items', self.component_config.exclude_items))
+        for message in messages:
+            message.text = normalize(message.text)
+            for key, value in message:
+                if key in exclude_items:
+                    continue
+                if isinstance(value, str):
+                    message[key] = normalize_cached(value) if len(value) <= cache_max_length else normalize(value)
+                elif isinstance(value, list):
+                    for idx, item_value in enumerate(value):
+                        value[idx] = (normalize_cached(item_value) if len(item_value) <= cache_max_length
+                                      else normalize(item_value))
 
 
 class HazmTokenizer(Component):
-    defaults = {"stemmer": True, "lemmatizer": True, 'pos': False}
+    defaults = {"stemmer": True, "lemmatizer": True, 'pos': False, 'pos_model': 'resources/postagger.model',
+                "cache_size": 100000, "cache_path": None}
 
     def __init__(self, component_config: Dict[Text, Any] = None) -> None:
 
         super().__init__(component_config)
+        from hazm import sent_tokenize, word_tokenize, Stemmer, Lemmatizer, POSTagger
+
+        self._sent_tokenize = sent_tokenize
+        self._word_tokenize = word_tokenize
+        self._caches = {}
         if self.component_config.stemmer:
             self._stemmer = Stemmer()
+            self._caches[TOKEN_ATTRIBUTE_STEM] = LookupCache(self._stemmer.stem, self.component_config.cache_size)
 
         if self.component_config.lemmatizer:
             self._lemmatizer = Lemmatizer()
+            self._caches[TOKEN_ATTRIBUTE_LEMM] = LookupCache(self._lemmatizer.lemmatize,
+                                                             self.component_config.cache_size)
+
+        load_caches(self.component_config.cache_path, **self._caches)
 
         if self.component_config.pos:
-            self._pos_tagger = POSTagger(model='resources/postagger.model')
+            self._pos_tagger = POSTagger(model=self.component_config.pos_model)
 
-    def required_packages(self) -> List[Text]:
+    @classmethod
+    def required_packages(cls) -> List[Text]:
         return ['hazm']
 
+    @property
+    def cache_stats(self) -> Dict[Text, Dict[Text, Any]]:
+        return {name: cache.stats for name, cache in self._caches.items()}
+
+    def persist(self) -> None:
+        if self.component_config.cache_path:
+            save_caches(self.component_config.cache_path, **self._caches)
+
     def process(self, message: Message, **kwargs: Any) -> None:
-        text = message.text
-        for sentence_str in sent_tokenize(text):
-            sentence = Sentence(sentence_str)
-            tokens = word_tokenize(sentence_str)
-            pos_tags = []
-            if self.component_config.pos:
-                pos_tags = self._pos_tagger.tag(tokens)
-            for idx, token_str in enumerate(tokens):
-                token = Token(text=token_str)
-                if self.component_config.stemmer:
-                    token[TOKEN_ATTRIBUTE_STEM] = self._stemmer.stem(token_str)
-                if self.component_config.lemmatizer:
-                    token[TOKEN_ATTRIBUTE_LEMM] = self._lemmatizer.lemmatize(token_str)
-                if self.component_config.pos:
-                    token[TOKEN_ATTRIBUTE_POS] = pos_tags[idx][1]
-                sentence.add_token(token)
-            message.add_sentence(sentence)
+        self.process_batch([message], **kwargs)
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> None:
+        stem = self._caches.get(TOKEN_ATTRIBUTE_STEM)
+        lemmatize = self._caches.get(TOKEN_ATTRIBUTE_LEMM)
+        sent_tokenize, word_tokenize = self._sent_tokenize, self._word_tokenize
+        sentences, sentence_tokens = [], []
+        for message in messages:
+            for sentence_str in sent_tokenize(message.text):
+                sentence = Sentence(sentence_str)
+                message.add_sentence(sentence)
+                sentences.append(sentence)
+                sentence_tokens.append(word_tokenize(sentence_str))
+
+        # the tagger is called once for all sentences of the batch
+        pos_tags = self._pos_tagger.tag_sents(sentence_tokens) if self.component_config.pos else None
+
+        for idx, (sentence, tokens) in enumerate(zip(sentences, sentence_tokens)):
+            attributes = {}
+            if stem is not None:
+                attributes[TOKEN_ATTRIBUTE_STEM] = [stem(t) for t in tokens]
+            if lemmatize is not None:
+                attributes[TOKEN_ATTRIBUTE_LEMM] = [lemmatize(t) for t in tokens]
+            if pos_tags is not None:
+                attributes[TOKEN_ATTRIBUTE_POS] = [tag for _, tag in pos_tags[idx]]
+            sentence.add_tokens(tokens, attributes)
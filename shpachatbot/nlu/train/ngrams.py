@@ -1,26 +1,183 @@
-from typing import Dict, Text, Any, List
-from nltk import ngrams
+import logging
+import os
+import uuid
+from collections import Counter
+from typing import Dict, Text, Any, List, Type, Iterable, Tuple, Optional, Sequence
 
+from shpachatbot.io import json_to_string, read_json_file, write_text_file, DEFAULT_ENCODING
 from shpachatbot.nlu.components import Component
 from shpachatbot.nlu.models import Message
 from shpachatbot.nlu.tokenizers.hazm import HazmTokenizer
 
+logger = logging.getLogger(__name__)
+
+TOKENS_FILE_NAME = "tokens.json"
+
+
+def _ngram_file_name(n: int) -> Text:
+    return f"{n}grams.tsv"
+
+
+class NgramCounter:
+    """Counts the n-grams of several orders in one pass over a corpus.
+
+    Tokens are encoded as integer ids and every n-gram is counted under the
+    tuple of its token ids. Counters of different workers have their own ids
+    and can be merged with `merge`.
+    """
+
+    def __init__(self, min_n: int = 2, max_n: int = 6) -> None:
+        self.min_n = min_n
+        self.max_n = max_n
+        self._token_ids = {}
+        self._tokens = []
+        self._counts = {n: Counter() for n in range(min_n, max_n + 1)}
+
+    def _encode(self, tokens: Iterable[Text]) -> List[int]:
+        token_ids = self._token_ids
+        ids = []
+        for token in tokens:
+            token_id = token_ids.get(token)
+            if token_id is None:
+                token_id = len(self._tokens)
+                token_ids[token] = token_id
+                self._tokens.append(token)
+            ids.append(token_id)
+        return ids
+
+    def add(self, tokens: Sequence[Text]) -> None:
+        """Count all n-grams of a sentence."""
+
+        ids = self._encode(tokens)
+        for n, counts in self._counts.items():
+            if n > len(ids):
+                continue
+            counts.update(zip(*(ids[i:] for i in range(n))))
+
+    def count(self, ngram: Sequence[Text]) -> int:
+        key = tuple(self._token_ids.get(t, -1) for t in ngram)
+        return self._counts[len(key)][key] if len(key) in self._counts else 0
+
+    def most_common(self, n: int, k: Optional[int] = None) -> List[Tuple[Text, int]]:
+        """The `k` most frequent n-grams of order `n` with their counts."""
+
+        return [(' '.join(self._tokens[i] for i in key), count)
+                for key, count in self._counts[n].most_common(k)]
+
+    def __len__(self) -> int:
+        return sum(len(counts) for counts in self._counts.values())
+
+    def merge(self, other: "NgramCounter") -> None:
+        """Add the counts of another counter to this counter."""
+
+        mapping = self._encode(other._tokens)
+        for n, other_counts in other._counts.items():
+            counts = self._counts.setdefault(n, Counter())
+            for key, count in other_counts.items():
+                counts[tuple(mapping[i] for i in key)] += count
+        self.min_n = min(self.min_n, other.min_n)
+        self.max_n = max(self.max_n, other.max_n)
+
+    def prune(self, min_count: int) -> None:
+        """Drop the n-grams seen less than `min_count` times."""
+
+        if min_count <= 1:
+            return
+        for n, counts in self._counts.items():
+            self._counts[n] = Counter({key: count for key, count in counts.items() if count >= min_count})
+
+    def save(self, path: Text) -> None:
+        """Write the tokens and one count table per order into a directory.
+
+        Each line of a count table holds the count and the token ids of an
+        n-gram, the most frequent first.
+        """
+        os.makedirs(path, exist_ok=True)
+        write_text_file(json_to_string(self._tokens, indent=None), os.path.join(path, TOKENS_FILE_NAME))
+        for n, counts in self._counts.items():
+            with open(os.path.join(path, _ngram_file_name(n)), 'w', encoding=DEFAULT_ENCODING) as f:
+                for key, count in counts.most_common():
+                    f.write(f"{count}\t{' '.join(map(str, key))}\n")
+
+    @classmethod
+    def load(cls, path: Text) -> "NgramCounter":
+        orders = sorted(int(f[:-len("grams.tsv")]) for f in os.listdir(path) if f.endswith("grams.tsv"))
+        counter = cls(min_n=orders[0], max_n=orders[-1]) if orders else cls()
+        counter._tokens = read_json_file(os.path.join(path, TOKENS_FILE_NAME))
+        counter._token_ids = {token: idx for idx, token in enumerate(counter._tokens)}
+        for n in orders:
+            counts = counter._counts.setdefault(n, Counter())
+            with open(os.path.join(path, _ngram_file_name(n)), encoding=DEFAULT_ENCODING) as f:
+                for line in f:
+                    count, key = line.rstrip('\n').split('\t')
+                    counts[tuple(int(i) for i in key.split(' '))] = int(count)
+        return counter
+
+
+def merge_saved_counts(counts_path: Text, min_count: int = 1) -> NgramCounter:
+    """Merge the counters saved by the workers of a pipeline into one pruned counter."""
+
+    counter = None
+    for entry in os.scandir(counts_path):
+        if not entry.is_dir():
+            continue
+        saved = NgramCounter.load(entry.path)
+        if counter is None:
+            counter = saved
+        else:
+            counter.merge(saved)
+    counter = counter if counter is not None else NgramCounter()
+    counter.prune(min_count)
+    return counter
+
 
 class Ngrams(Component):
-    def __init__(self, component_config: Dict[Text, Any] = None) -> None:
-        """Construct a new tokenizer using the WhitespaceTokenizer framework."""
+    """Counts corpus-wide n-grams of the sentence tokens.
+
+    With `counts_path` the counts are saved into a new directory under that
+    path whenever the component is persisted and whenever a batch leaves
+    more than `max_ngrams` distinct n-grams in memory, so the memory of a
+    worker does not grow with the corpus. `merge_saved_counts` combines the
+    saved counts of all processes. `sentence_ngrams` additionally attaches the
+    n-gram strings of every order to each sentence.
+    """
+
+    defaults = {"min_n": 2, "max_n": 6, "attribute": "text", "counts_path": None, "sentence_ngrams": False,
+                "max_ngrams": 5000000}
 
+    def __init__(self, component_config: Dict[Text, Any] = None) -> None:
         super().__init__(component_config)
+        self.counter = NgramCounter(self.component_config.min_n, self.component_config.max_n)
 
-    def required_packages(self) -> List[Text]:
-        return ['nltk']
+    @classmethod
+    def required_components(cls) -> List[Type[Component]]:
+        return [HazmTokenizer]
 
     def process(self, message: Message, **kwargs: Any) -> None:
-        n = 2
-        if 'n' in kwargs:
-            n = kwargs['n']
-        for sentence in message.sentences:
-            tokens = [t.text for t in sentence.tokens]
-            if n <= len(tokens):
-                t = [' '.join(g) for g in ngrams(tokens, n)]
-                sentence[f"{n}grams"] = [' '.join(g) for g in ngrams(tokens, n)]
+        self.process_batch([message], **kwargs)
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> None:
+        attribute = self.component_config.attribute
+        orders = range(self.component_config.min_n, self.component_config.max_n + 1)
+        add = self.counter.add
+        for message in messages:
+            for sentence in message.sentences:
+                tokens = sentence.token_attribute(attribute)
+                add(tokens)
+                if self.component_config.sentence_ngrams:
+                    for n in orders:
+                        if n <= len(tokens):
+                            sentence[f"{n}grams"] = [' '.join(g) for g in zip(*(tokens[i:] for i in range(n)))]
+        max_ngrams = self.component_config.max_ngrams
+        if max_ngrams and self.component_config.counts_path and len(self.counter) > max_ngrams:
+            self.persist()
+
+    def persist(self) -> None:
+        counts_path = self.component_config.counts_path
+        if not counts_path or not len(self.counter):
+            return
+        path = os.path.join(counts_path, uuid.uuid4().hex[:12])
+        self.counter.save(path)
+        logger.debug(f"Saved {len(self.counter)} n-gram counts to '{path}'.")
+        # the saved counts must not be saved again by a later call
+        self.counter = NgramCounter(self.component_config.min_n, self.component_config.max_n)
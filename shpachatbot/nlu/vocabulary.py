@@ -0,0 +1,176 @@
+import logging
+import os
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple, Type
+
+import numpy as np
+
+from shpachatbot.io import json_to_string, read_json_file, write_text_file
+from shpachatbot.nlu.components import Component
+from shpachatbot.nlu.models import Message, Sentence
+from shpachatbot.nlu.tokenizers.hazm import HazmTokenizer
+from shpachatbot.constants import TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_TOKEN = "<unk>"
+UNKNOWN_ID = 0
+COUNTS_FILE_PREFIX = "vocabulary-counts-"
+
+
+class Vocabulary(Component):
+    """Maps surface forms, stems and lemmas to stable integer ids.
+
+    All attributes share one id space, id 0 stands for unknown forms. While
+    processing messages the component counts the forms of the configured
+    token attributes. With `counts_path` each persist saves these counts, the
+    counts of all workers are merged by `build_from_counts`. Ids are ordered
+    by frequency, forms added by a rebuild get new ids at the end, so
+    existing ids never change. A vocabulary saved to `vocabulary_path` is loaded when the
+    component is created and encodes messages into NumPy id arrays.
+    """
+
+    defaults = {
+        "attributes": [TEXT, TOKEN_ATTRIBUTE_STEM, TOKEN_ATTRIBUTE_LEMM],
+        "counts_path": None,
+        "vocabulary_path": None,
+    }
+
+    def __init__(self, component_config: Dict[Text, Any] = None, forms: Optional[Iterable[Text]] = None) -> None:
+        super().__init__(component_config)
+        self._forms = [UNKNOWN_TOKEN]
+        self._ids = {UNKNOWN_TOKEN: UNKNOWN_ID}
+        self.counts = Counter()
+
+        vocabulary_path = self.component_config.vocabulary_path
+        if forms is None and vocabulary_path and os.path.exists(vocabulary_path):
+            forms = read_json_file(vocabulary_path)
+        self.extend(forms or [])
+
+    @classmethod
+    def required_components(cls) -> List[Type[Component]]:
+        return [HazmTokenizer]
+
+    def __len__(self) -> int:
+        return len(self._forms)
+
+    def __contains__(self, form: Text) -> bool:
+        return form in self._ids
+
+    @property
+    def forms(self) -> List[Text]:
+        return self._forms
+
+    def extend(self, forms: Iterable[Text]) -> None:
+        """Give ids to the forms which are not in the vocabulary yet."""
+
+        for form in forms:
+            if form not in self._ids:
+                self._ids[form] = len(self._forms)
+                self._forms.append(form)
+
+    def merge(self, other: "Vocabulary") -> None:
+        self.extend(other.forms)
+        self.counts.update(other.counts)
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        self.process_batch([message], **kwargs)
+
+    def process_batch(self, messages: List[Message], **kwargs: Any) -> None:
+        attributes = self.component_config.attributes
+        counts = self.counts
+        for message in messages:
+            for sentence in message.sentences:
+                for attribute in attributes:
+                    counts.update(f for f in sentence.token_attribute(attribute) if f is not None)
+
+    def persist(self) -> None:
+        counts_path = self.component_config.counts_path
+        if not counts_path or not self.counts:
+            return
+        os.makedirs(counts_path, exist_ok=True)
+        path = os.path.join(counts_path, f"{COUNTS_FILE_PREFIX}{uuid.uuid4().hex[:12]}.json")
+        write_text_file(json_to_string(self.counts, indent=None), path)
+        logger.debug(f"Saved the counts of {len(self.counts)} forms to '{path}'.")
+        # the saved counts must not be saved again by a later call
+        self.counts = Counter()
+
+    @classmethod
+    def build(
+            cls,
+            counts: Counter,
+            min_count: int = 1,
+            component_config: Optional[Dict[Text, Any]] = None,
+            base: Optional["Vocabulary"] = None,
+    ) -> "Vocabulary":
+        """Create a vocabulary of the forms seen at least `min_count` times.
+
+        The most frequent forms get the smallest ids, forms of the same
+        frequency are ordered alphabetically, so the ids do not depend on the
+        order in which the counts were collected. With a `base` vocabulary,
+        e.g. the one a stored corpus was encoded with, all its forms keep
+        their ids and only the new forms are appended in this order.
+        """
+        known = base.forms if base is not None else [UNKNOWN_TOKEN]
+        known_set = set(known)
+        new_forms = sorted((f for f, c in counts.items() if c >= min_count and f not in known_set),
+                           key=lambda f: (-counts[f], f))
+        forms = known[1:] + new_forms
+        vocabulary = cls(component_config, forms=forms)
+        vocabulary.counts = Counter({f: counts[f] for f in forms if f in counts})
+        return vocabulary
+
+    @classmethod
+    def build_from_counts(
+            cls,
+            counts_path: Text,
+            min_count: int = 1,
+            component_config: Optional[Dict[Text, Any]] = None,
+            base: Optional["Vocabulary"] = None,
+    ) -> "Vocabulary":
+        """Build a vocabulary from the counts saved by the workers of a pipeline.
+
+        The vocabulary at the `vocabulary_path` of the configuration, or
+        `base`, keeps its ids when the corpus is updated, so the ids in
+        stored corpora and features stay valid.
+        """
+        vocabulary_path = (component_config or {}).get("vocabulary_path")
+        if base is None and vocabulary_path and os.path.exists(vocabulary_path):
+            base = cls.load(vocabulary_path)
+
+        counts = Counter()
+        for file_name in os.listdir(counts_path):
+            if file_name.startswith(COUNTS_FILE_PREFIX):
+                counts.update(read_json_file(os.path.join(counts_path, file_name)))
+        return cls.build(counts, min_count, component_config, base)
+
+    def save(self, vocabulary_path: Text) -> None:
+        write_text_file(json_to_string(self._forms[1:], indent=None), vocabulary_path)
+
+    @classmethod
+    def load(cls, vocabulary_path: Text) -> "Vocabulary":
+        return cls({"vocabulary_path": vocabulary_path})
+
+    def encode_tokens(self, tokens: Iterable[Text]) -> np.ndarray:
+        ids = self._ids
+        return np.fromiter((ids.get(t, UNKNOWN_ID) for t in tokens), dtype=np.int32)
+
+    def encode_sentence(self, sentence: Sentence, attribute: Text = TEXT) -> np.ndarray:
+        return self.encode_tokens(sentence.token_attribute(attribute))
+
+    def encode(self, message: Message, attribute: Text = TEXT) -> Tuple[np.ndarray, np.ndarray]:
+        """Encode the tokens of a message.
+
+        Returns:
+            The ids of all tokens of the message and the offsets of its
+            sentences in them, sentence `i` is `ids[offsets[i]:offsets[i + 1]]`.
+        """
+        sentences = [self.encode_sentence(s, attribute) for s in message.sentences]
+        offsets = np.zeros(len(sentences) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in sentences], out=offsets[1:])
+        ids = np.concatenate(sentences) if sentences else np.zeros(0, dtype=np.int32)
+        return ids, offsets
+
+    def decode(self, ids: Iterable[int]) -> List[Text]:
+        return [self._forms[i] for i in ids]
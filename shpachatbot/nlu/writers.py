@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import uuid
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+from shpachatbot.exceptions import SHPAException
+from shpachatbot.io import DEFAULT_ENCODING
+from shpachatbot.nlu.models import Message
+from shpachatbot.nlu.serialization import dumps_message, get_json_backend
+
+logger = logging.getLogger(__name__)
+
+SHARD_FORMATS = {"jsonl": ".jsonl", "msgpack": ".msgpack"}
+INDEX_SUFFIX = ".index"
+
+
+class UnknownShardFormatException(SHPAException):
+    def __init__(self, shard_format: Text) -> None:
+        self.shard_format = shard_format
+
+    def __str__(self) -> Text:
+        return f"Unknown shard format '{self.shard_format}', use one of: {', '.join(SHARD_FORMATS)}"
+
+
+def _decode_json(data: bytes) -> Dict[Text, Any]:
+    return get_json_backend().loads(data)
+
+
+class ShardWriter:
+    """Writes messages into rotated shard files instead of one file per message.
+
+    A shard is closed when it reaches `max_shard_bytes` or `max_shard_messages`.
+    Records are compact json lines (`jsonl`), encoded with `json_backend`,
+    or msgpack objects (`msgpack`).
+    Next to the shards an index file maps each message id to the shard, byte
+    offset and length of its record. `delete` writes a tombstone into the
+    index, which hides the earlier records of a message. Every writer uses
+    its own unique shard names, so several worker processes can write to
+    the same directory.
+    """
+
+    def __init__(
+            self,
+            out_path: Text,
+            prefix: Text = "messages",
+            shard_format: Text = "jsonl",
+            max_shard_bytes: int = 256 * 1024 * 1024,
+            max_shard_messages: Optional[int] = None,
+            buffer_size: int = 1024 * 1024,
+            json_backend: Optional[Text] = None,
+    ) -> None:
+        if shard_format not in SHARD_FORMATS:
+            raise UnknownShardFormatException(shard_format)
+
+        self._out_path = out_path
+        self._name = f"{prefix}-{uuid.uuid4().hex[:12]}"
+        self._shard_format = shard_format
+        self._max_shard_bytes = max_shard_bytes
+        self._max_shard_messages = max_shard_messages
+        self._buffer_size = buffer_size
+
+        if shard_format == "msgpack":
+            import msgpack
+
+            pack = msgpack.Packer(use_bin_type=True).pack
+            self._encode = lambda message: pack(message.dict)
+        else:
+            backend = get_json_backend(json_backend)
+            self._encode = lambda message: dumps_message(message, backend) + b"\n"
+
+        self._shard_no = -1
+        self._shard_name = None
+        self._shard_file = None
+        self._shard_bytes = 0
+        self._shard_messages = 0
+        self._index_file = None
+
+    def _open_shard(self) -> None:
+        self._close_shard()
+        self._shard_no += 1
+        self._shard_name = f"{self._name}-{self._shard_no:05d}{SHARD_FORMATS[self._shard_format]}"
+        self._shard_file = open(os.path.join(self._out_path, self._shard_name), "wb", buffering=self._buffer_size)
+        self._shard_bytes = 0
+        self._shard_messages = 0
+
+    def _write_index(self, entry: List[Any]) -> None:
+        if self._index_file is None:
+            self._index_file = open(os.path.join(self._out_path, f"{self._name}{INDEX_SUFFIX}"), "w",
+                                    encoding=DEFAULT_ENCODING, buffering=self._buffer_size)
+        self._index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _close_shard(self) -> None:
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+
+    def _is_shard_full(self) -> bool:
+        if self._shard_bytes >= self._max_shard_bytes:
+            return True
+        return bool(self._max_shard_messages) and self._shard_messages >= self._max_shard_messages
+
+    def write(self, message: Message) -> None:
+        if self._shard_file is None or self._is_shard_full():
+            self._open_shard()
+
+        data = self._encode(message)
+        self._shard_file.write(data)
+        self._write_index([message['id'], self._shard_name, self._shard_bytes, len(data)])
+        self._shard_bytes += len(data)
+        self._shard_messages += 1
+
+    def write_all(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            self.write(message)
+
+    def delete(self, message_id: Text) -> None:
+        """Hide the records of a message written before, e.g. by an earlier run."""
+
+        self._write_index([message_id, None, 0, 0])
+
+    def flush(self) -> None:
+        if self._shard_file is not None:
+            self._shard_file.flush()
+        if self._index_file is not None:
+            self._index_file.flush()
+
+    def close(self) -> None:
+        self._close_shard()
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def read_index(out_path: Text) -> Dict[Text, Tuple[Text, int, int]]:
+    """Read the index files of a shard directory.
+
+    Returns:
+        A mapping from message id to shard name, byte offset and length. When a
+        message was written more than once the most recent record wins, a
+        message whose most recent entry is a tombstone is left out.
+    """
+    index_paths = [os.path.join(out_path, f) for f in os.listdir(out_path) if f.endswith(INDEX_SUFFIX)]
+    index = {}
+    for index_path in sorted(index_paths, key=os.path.getmtime):
+        with open(index_path, encoding=DEFAULT_ENCODING) as f:
+            for line in f:
+                message_id, shard_name, offset, length = json.loads(line)
+                if shard_name is None:
+                    index.pop(message_id, None)
+                else:
+                    index[message_id] = (shard_name, offset, length)
+    return index
+
+
+def shard_files(out_path: Text, prefix: Text = "messages") -> List[Text]:
+    """The names of the shard and index files written by `ShardWriter`s with `prefix` into a directory."""
+
+    suffixes = (INDEX_SUFFIX, *SHARD_FORMATS.values())
+    return [f for f in os.listdir(out_path) if f.startswith(f"{prefix}-") and f.endswith(suffixes)]
+
+
+def read_record(out_path: Text, shard_name: Text, offset: int, length: int) -> Dict[Text, Any]:
+    """Read a single message record from a shard."""
+
+    with open(os.path.join(out_path, shard_name), "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+
+    if shard_name.endswith(SHARD_FORMATS["msgpack"]):
+        import msgpack
+
+        return msgpack.unpackb(data, raw=False)
+    return _decode_json(data)
+
+
+def iter_records(out_path: Text) -> Iterator[Dict[Text, Any]]:
+    """Iterate over the most recent record of every message in a shard directory.
+
+    Records are read shard by shard in file order, so each shard is opened
+    only once.
+    """
+    by_shard = {}
+    for shard_name, offset, length in read_index(out_path).values():
+        by_shard.setdefault(shard_name, []).append((offset, length))
+
+    for shard_name in sorted(by_shard):
+        if shard_name.endswith(SHARD_FORMATS["msgpack"]):
+            import msgpack
+
+            decode = partial(msgpack.unpackb, raw=False)
+        else:
+            decode = _decode_json
+        with open(os.path.join(out_path, shard_name), "rb") as f:
+            for offset, length in sorted(by_shard[shard_name]):
+                f.seek(offset)
+                yield decode(f.read(length))
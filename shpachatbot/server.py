@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Text, Union, TYPE_CHECKING
+
+from shpachatbot.config import load
+from shpachatbot.io import json_to_string
+from shpachatbot.nlu.cache import LookupCache
+from shpachatbot.nlu.models import Message
+from shpachatbot.nlu.pipline import Pipeline
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5005
+
+
+class LatencyRecorder:
+    """Keeps the latencies of the last `size` requests to report their percentiles."""
+
+    def __init__(self, size: int = 10000) -> None:
+        self._latencies: Deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self.count += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    @property
+    def stats(self) -> Dict[Text, Any]:
+        """The p50, p95 and p99 latencies in milliseconds."""
+
+        stats = {"requests": self.count}
+        for percent in (50, 95, 99):
+            latency = self.percentile(percent)
+            stats[f"p{percent}_ms"] = latency * 1000 if latency is not None else None
+        return stats
+
+
+class MicroBatcher:
+    """Collects concurrent utterances into batches for a pipeline.
+
+    A batch is processed when it holds `max_batch_size` utterances or when
+    `max_delay` seconds passed since its first utterance arrived. The
+    pipeline runs in a single background thread, so the event loop keeps
+    accepting requests while a batch is processed and the components are
+    never used by two threads at once. The serialized results are cached by
+    utterance, identical utterances waiting for the same batch are only
+    processed once.
+    """
+
+    def __init__(
+            self,
+            pipeline: Pipeline,
+            max_batch_size: int = 32,
+            max_delay: float = 0.005,
+            cache_size: int = 10000,
+    ) -> None:
+        self._pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.cache = LookupCache(max_size=cache_size)
+        self.latency = LatencyRecorder()
+        self.batches = 0
+        self.batched_messages = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[Text, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+        self._task: Optional[asyncio.Task] = None
+
+    def _process_batch(self, texts: List[Text]) -> List[Text]:
+        messages = [Message(text) for text in texts]
+        processed = {id(message) for message in self._pipeline.process_batch(messages)}
+        results = []
+        for message in messages:
+            result = message.dict
+            if id(message) not in processed:
+                # a filtering component, e.g. `DuplicateFilter`, dropped the message, its
+                # properties tell why, e.g. the id of the message it duplicates
+                result["dropped"] = True
+            results.append(json_to_string(result, indent=None))
+        return results
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def process(self, text: Text) -> Text:
+        """Process an utterance and return its message serialized as json."""
+
+        start = time.perf_counter()
+        result = self.cache.get(text)
+        if result is None:
+            future = self._pending.get(text)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[text] = future
+                self._queue.put_nowait(text)
+            result = await asyncio.shield(future)
+        self.latency.add(time.perf_counter() - start)
+        return result
+
+    async def _next_batch(self) -> List[Text]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await loop.run_in_executor(self._executor, self._process_batch, batch)
+            except Exception as error:
+                logger.exception(f"Failed to process a batch of {len(batch)} utterances.")
+                for text in batch:
+                    future = self._pending.pop(text)
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self.batches += 1
+            self.batched_messages += len(batch)
+            self.cache.update(dict(zip(batch, results)))
+            for text, result in zip(batch, results):
+                future = self._pending.pop(text)
+                if not future.done():
+                    future.set_result(result)
+
+    @property
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            "latency": self.latency.stats,
+            "batches": self.batches,
+            "average_batch_size": self.batched_messages / self.batches if self.batches else None,
+            "cache": self.cache.stats,
+        }
+
+
+def create_app(
+        config: Optional[Union[Text, Dict[Text, Any]]] = None,
+        max_batch_size: int = 32,
+        max_delay: float = 0.005,
+        cache_size: int = 10000,
+        pipeline: Optional[Pipeline] = None,
+) -> "web.Application":
+    """Create the web application of the NLU server.
+
+    The pipeline of `config` is created once. `POST /parse` with a json
+    body `{"text": ...}` returns the processed message, `"dropped": true`
+    if a filtering component removed it, `GET /stats` the latency
+    percentiles, batch sizes and cache statistics.
+    """
+    from aiohttp import web
+
+    batcher = MicroBatcher(pipeline or Pipeline.create(load(config)), max_batch_size, max_delay, cache_size)
+
+    async def parse(request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({"error": "The request body is not valid json."}, status=400)
+        text = body.get("text") if isinstance(body, dict) else None
+        if not isinstance(text, str):
+            return web.json_response({"error": "The request body needs a 'text' string."}, status=400)
+        return web.Response(text=await batcher.process(text), content_type="application/json")
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(batcher.stats)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def on_startup(app: web.Application) -> None:
+        batcher.start()
+
+    async def on_cleanup(app: web.Application) -> None:
+        await batcher.stop()
+
+    app = web.Application()
+    app["batcher"] = batcher
+    app.router.add_post("/parse", parse)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serve the NLU pipeline over http.")
+    parser.add_argument("--config", help="configuration file of the pipeline, the default configuration if omitted")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=32, help="maximum number of utterances per batch")
+    parser.add_argument("--max-delay-ms", type=float, default=5.0,
+                        help="maximum time an utterance waits for its batch to fill up")
+    parser.add_argument("--cache-size", type=int, default=10000, help="number of cached utterances")
+    return parser
+
+
+if __name__ == "__main__":
+    from aiohttp.web import run_app
+
+    logging.basicConfig(level=logging.INFO)
+    arguments = create_argument_parser().parse_args()
+    run_app(create_app(arguments.config, arguments.max_batch_size, arguments.max_delay_ms / 1000,
+                       arguments.cache_size),
+            host=arguments.host, port=arguments.port)
@@ -1,5 +1,7 @@
-from typing import Optional, Text, Dict, Any
+from typing import Optional, Text, Dict, Any, Iterable, Iterator, List
 import copy
+import hashlib
+import json
 
 
 def override_defaults(
@@ -28,4 +30,47 @@ def override_defaults(
             else:
                 config[key] = custom[key]
 
-    return config
\ No newline at end of file
+    return config
+
+
+def chunks(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split an iterable into lists of at most `size` items.
+
+    Args:
+        iterable: items to split, it is consumed lazily
+        size: maximum number of items in a chunk
+
+    Returns:
+        iterator over the chunks
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_text_hash(text: Text, encoding: Text = "utf-8") -> Text:
+    """Calculate the sha1 hash of a text."""
+
+    return hashlib.sha1(text.encode(encoding)).hexdigest()
+
+
+def get_dictionary_fingerprint(dictionary: Dict[Any, Any]) -> Text:
+    """Calculate a hash which does not depend on the order of the dictionary keys."""
+
+    stringified = json.dumps(dictionary, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return get_text_hash(stringified)
+
+
+def get_file_hash(file_path: Text, block_size: int = 1024 * 1024) -> Text:
+    """Calculate the sha1 hash of the content of a file."""
+
+    file_hash = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
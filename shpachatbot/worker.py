@@ -1,11 +1,69 @@
+from collections import deque
 from concurrent import futures
-from typing import Callable, Iterable
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
 
-from tqdm import tqdm
 
+def worker_start(worker_func: Callable, worker_itr: Iterable, workers: int = 8, enable_tqdm: bool = True,
+                 initializer: Optional[Callable] = None, initargs: Tuple[Any, ...] = ()):
+    """Run `worker_func` over `worker_itr` in a pool of processes.
 
-def worker_start(worker_func: Callable, worker_itr: Iterable, workers: int = 8, enable_tqdm: bool = True):
-    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
-        if enable_tqdm:
-            return list(tqdm(executor.map(worker_func, worker_itr), total=len(worker_itr)))
-        return list(executor.map(worker_func, worker_itr))
+    `initializer` is called once with `initargs` in every worker process, so
+    state which is expensive to build or to pickle can be created there
+    instead of being sent along with each task.
+    """
+    return list(worker_imap(worker_func, worker_itr, workers=workers, enable_tqdm=enable_tqdm,
+                            initializer=initializer, initargs=initargs))
+
+
+def worker_imap(worker_func: Callable, worker_itr: Iterable, workers: int = 8, enable_tqdm: bool = True,
+                initializer: Optional[Callable] = None, initargs: Tuple[Any, ...] = (),
+                ordered: bool = True, max_in_flight: Optional[int] = None) -> Iterator[Any]:
+    """Lazily run `worker_func` over `worker_itr` and yield results as they complete.
+
+    `worker_itr` is consumed on demand and may be a generator of unknown length.
+    At most `max_in_flight` tasks (twice the number of workers by default) are
+    submitted but not yet yielded, which bounds the memory held by pending
+    inputs and outputs.
+
+    Args:
+        worker_func: picklable function to call for each item
+        worker_itr: the items to process
+        workers: number of worker processes
+        enable_tqdm: show a progress bar
+        initializer: called once with `initargs` in every worker process
+        initargs: arguments of `initializer`
+        ordered: yield results in input order, otherwise in completion order
+        max_in_flight: maximum number of pending tasks
+
+    Returns:
+        iterator over the results
+    """
+    from tqdm import tqdm
+
+    max_in_flight = max_in_flight or 2 * workers
+    total = len(worker_itr) if hasattr(worker_itr, '__len__') else None
+    items = iter(worker_itr)
+
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        progress = tqdm(total=total, disable=not enable_tqdm)
+        try:
+            if ordered:
+                pending = deque(executor.submit(worker_func, item) for item in islice(items, max_in_flight))
+                while pending:
+                    result = pending.popleft().result()
+                    for item in islice(items, 1):
+                        pending.append(executor.submit(worker_func, item))
+                    progress.update()
+                    yield result
+            else:
+                pending = {executor.submit(worker_func, item) for item in islice(items, max_in_flight)}
+                while pending:
+                    done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    for item in islice(items, len(done)):
+                        pending.add(executor.submit(worker_func, item))
+                    for future in done:
+                        progress.update()
+                        yield future.result()
+        finally:
+            progress.close()
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("hazm", "nltk", "elasticsearch", "ruamel", "bs4", "lxml", "numpy", "scipy", "tqdm")
+
+
+@pytest.mark.parametrize("module", ["shpachatbot.nlu.pipline", "shpachatbot.config", "shpachatbot.server"])
+def test_import_does_not_load_heavy_dependencies(module):
+    # a fresh interpreter, modules imported by other tests must not hide a regression
+    code = (
+        f"import sys, {module}\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True, cwd=REPOSITORY_PATH)
+    assert result.stdout.strip() == ""